@@ -0,0 +1,219 @@
+"""
+Score/comment consistency rules engine.
+
+Checks that criterion scores agree with the tone of the examiner's notes and
+overall comment, and nudges clear mismatches (e.g. "excellent" with a band
+below 5). The keyword sets and rules are data (DEFAULT_RULES, or a JSON file
+named by CONSISTENCY_RULES_PATH). Each note and the overall comment are
+lowercased once and checked for every keyword once, rather than once per
+criterion and keyword set.
+"""
+
+import json
+import os
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.grading import round_to_half
+
+load_dotenv()
+
+CRITERIA = ("TR", "CC", "LR", "GRA")
+
+
+# Rule fields:
+#   keywords   - keyword set to count
+#   scope      - "note", "comment" or "note_or_comment" (keyword found in either)
+#   min_count  - rule fires when at least this many keywords of the set match
+#   score_below / score_above - bound on the model's original score
+#   require    - optional second keyword set that must also match in the note
+#   raise_to / lower_to - new floor / ceiling for the score
+#   group      - rules sharing a group are exclusive; the first match wins
+DEFAULT_RULES: Dict[str, Any] = {
+    "keyword_sets": {
+        "positive": [
+            "accurate", "accurately", "well-structured", "well organized",
+            "effective", "effectively", "clear", "comprehensive", "good",
+            "appropriate", "varied", "mostly correct", "competent",
+            "excellent", "outstanding", "very good", "strong",
+        ],
+        "very_positive": [
+            "excellent", "outstanding", "very good", "strong", "impressive",
+        ],
+        "negative": [
+            "major", "significant", "serious", "frequent", "many errors",
+            "poor", "weak", "inadequate", "limited", "fails",
+        ],
+        "severe": ["major", "significant", "serious", "fails"],
+    },
+    # Only clear mismatches are adjusted; positive comments are not forced
+    # to >= 6.0, so natural variation is kept
+    "criterion_rules": [
+        {
+            "name": "very_positive_low_score",
+            "keywords": "very_positive",
+            "scope": "note_or_comment",
+            "min_count": 1,
+            "score_below": 5.0,
+            "raise_to": 5.5,
+            "group": "raise",
+        },
+        {
+            "name": "positive_very_low_score",
+            "keywords": "positive",
+            "scope": "note_or_comment",
+            "min_count": 1,
+            "score_below": 4.0,
+            "raise_to": 4.5,
+            "group": "raise",
+        },
+        {
+            "name": "major_problems_high_score",
+            "keywords": "negative",
+            "scope": "note",
+            "min_count": 2,
+            "score_above": 5.5,
+            "require": "severe",
+            "lower_to": 5.5,
+        },
+    ],
+    "overall_rules": [
+        {
+            # Very positive overall comment with an extremely low average:
+            # scale all scores up so the average reaches target_average
+            "name": "very_positive_low_average",
+            "keywords": "very_positive",
+            "min_count": 1,
+            "average_below": 4.0,
+            "target_average": 4.5,
+        },
+    ],
+}
+
+
+class ConsistencyEngine:
+    """
+    Compiled form of a rules document. Build once and reuse across requests.
+    """
+
+    def __init__(self, rules: Optional[Dict[str, Any]] = None):
+        self.rules = rules or DEFAULT_RULES
+        keyword_sets = {
+            name: frozenset(k.lower() for k in words)
+            for name, words in self.rules["keyword_sets"].items()
+        }
+        self.keyword_sets: Dict[str, FrozenSet[str]] = keyword_sets
+        self._keywords = tuple(sorted(set().union(*keyword_sets.values())))
+        self.criterion_rules: List[Dict[str, Any]] = self.rules.get("criterion_rules", [])
+        self.overall_rules: List[Dict[str, Any]] = self.rules.get("overall_rules", [])
+        # Rules resolved to tuples with their keyword sets looked up once
+        self._criterion_rules = [
+            (
+                keyword_sets[rule["keywords"]],
+                rule.get("scope", "note"),
+                rule.get("min_count", 1),
+                rule.get("score_below"),
+                rule.get("score_above"),
+                keyword_sets[rule["require"]] if "require" in rule else None,
+                rule.get("raise_to"),
+                rule.get("lower_to"),
+                rule.get("group"),
+            )
+            for rule in self.criterion_rules
+        ]
+        self._overall_rules = [
+            (
+                keyword_sets[rule["keywords"]],
+                rule.get("min_count", 1),
+                rule["average_below"],
+                rule["target_average"],
+            )
+            for rule in self.overall_rules
+        ]
+
+    def scan(self, text: str) -> FrozenSet[str]:
+        """
+        Set of keywords occurring (as substrings) in text, case-insensitively.
+        """
+        text = text.lower()
+        return frozenset(k for k in self._keywords if k in text)
+
+    def check(
+        self,
+        scores: Dict[str, float],
+        notes: Dict[str, str],
+        overall_comment: str,
+    ) -> Tuple[Dict[str, float], bool]:
+        """
+        Validate and potentially adjust scores to match the tone of comments.
+        Returns (adjusted_scores, was_adjusted)
+        """
+        note_sets = [self.scan(notes.get(c, "")) for c in CRITERIA]
+        comment_found = self.scan(overall_comment)
+        adjusted = dict(scores)
+        was_adjusted = False
+
+        for criterion, note_found in zip(CRITERIA, note_sets):
+            score = scores[criterion]
+            either_found = note_found | comment_found
+            fired_groups = set()
+            for (keywords, scope, min_count, below, above, require,
+                 raise_to, lower_to, group) in self._criterion_rules:
+                if group is not None and group in fired_groups:
+                    continue
+                if below is not None and not score < below:
+                    continue
+                if above is not None and not score > above:
+                    continue
+                found = note_found if scope == "note" else comment_found if scope == "comment" else either_found
+                if len(keywords & found) < min_count:
+                    continue
+                if require is not None and not require & note_found:
+                    continue
+                if raise_to is not None:
+                    adjusted[criterion] = max(raise_to, score)
+                if lower_to is not None:
+                    adjusted[criterion] = min(lower_to, score)
+                was_adjusted = True
+                if group is not None:
+                    fired_groups.add(group)
+
+        for keywords, min_count, average_below, target_average in self._overall_rules:
+            if len(keywords & comment_found) < min_count:
+                continue
+            avg_score = sum(adjusted.values()) / len(adjusted)
+            if 0 < avg_score < average_below:
+                boost_factor = target_average / avg_score
+                for criterion in adjusted:
+                    adjusted[criterion] = min(9.0, adjusted[criterion] * boost_factor)
+                was_adjusted = True
+
+        for criterion in adjusted:
+            adjusted[criterion] = round_to_half(adjusted[criterion])
+
+        return adjusted, was_adjusted
+
+    def check_batch(
+        self,
+        items: Iterable[Tuple[Dict[str, float], Dict[str, str], str]],
+    ) -> List[Tuple[Dict[str, float], bool]]:
+        """
+        Run check() over many (scores, notes, overall_comment) results,
+        e.g. when bulk regrading historical submissions.
+        """
+        return [self.check(scores, notes, comment) for scores, notes, comment in items]
+
+
+def load_rules(path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Rules from a JSON file (same shape as DEFAULT_RULES), or the defaults.
+    """
+    path = path or os.getenv("CONSISTENCY_RULES_PATH")
+    if not path:
+        return DEFAULT_RULES
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+default_engine = ConsistencyEngine(load_rules())
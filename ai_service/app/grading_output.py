@@ -0,0 +1,211 @@
+"""
+Structured output contract for the grading call.
+
+grading_response_format() asks the model for JSON that matches the
+TR/CC/LR/GRA/notes schema (OpenAI structured outputs), so the reply is
+normally valid as-is. When it is not (a model without json_schema support,
+markdown fences, numbers sent as strings), parse_grading_output tries a
+cheap local repair before the caller pays for another full grading call.
+Every outcome is counted in output_stats.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CRITERIA = ("TR", "CC", "LR", "GRA")
+
+# "1" sends response_format=json_schema; set to "0" for models without
+# structured output support (the prompt still describes the schema)
+GRADE_STRUCTURED_OUTPUT = os.getenv("GRADE_STRUCTURED_OUTPUT", "1") == "1"
+# Full grading calls allowed after the first when the reply can't be repaired
+GRADE_MAX_RETRIES = int(os.getenv("GRADE_MAX_RETRIES", "1"))
+
+DEFAULT_IMPROVEMENT_PLAN = [
+    "Review the task requirements and ensure all key features are covered.",
+    "Practise organising your response with a clear overview and supporting details.",
+    "Expand vocabulary range and review grammar accuracy.",
+]
+
+GRADING_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        **{c: {"type": "number"} for c in CRITERIA},
+        "notes": {
+            "type": "object",
+            "properties": {c: {"type": "string"} for c in CRITERIA},
+            "required": list(CRITERIA),
+            "additionalProperties": False,
+        },
+        "overall_comment": {"type": "string"},
+        "improvement_plan": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": [*CRITERIA, "notes", "overall_comment", "improvement_plan"],
+    "additionalProperties": False,
+}
+
+# Extra field requested when the grading call also analyses the chart
+# (VISION_GRADING_MODE=single_call)
+CHART_ANALYSIS_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "visual_type": {"type": "string"},
+        "key_features": {"type": "array", "items": {"type": "string"}},
+        "data_points": {"type": "array", "items": {"type": "string"}},
+        "summary": {"type": "string"},
+    },
+    "required": ["visual_type", "key_features", "data_points", "summary"],
+    "additionalProperties": False,
+}
+
+
+@lru_cache(maxsize=2)
+def grading_response_format(with_chart_analysis: bool = False) -> Dict[str, Any]:
+    schema = GRADING_SCHEMA
+    if with_chart_analysis:
+        schema = {
+            **GRADING_SCHEMA,
+            "properties": {**GRADING_SCHEMA["properties"], "chart_analysis": CHART_ANALYSIS_SCHEMA},
+            "required": [*GRADING_SCHEMA["required"], "chart_analysis"],
+        }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "ielts_writing_grade_with_chart" if with_chart_analysis else "ielts_writing_grade",
+            "strict": True,
+            "schema": schema,
+        },
+    }
+
+
+_FENCE_RE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+class GradingOutputError(ValueError):
+    """
+    The model reply could not be turned into a valid grading result.
+    """
+
+
+class OutputStats:
+    """
+    Thread-safe counters for how grading replies were handled:
+    valid (schema-valid as returned), repaired (fixed locally),
+    retried (another grading call was made) and failed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+output_stats = OutputStats()
+
+
+def _extract_json(content: str) -> Tuple[Any, List[str]]:
+    repairs: List[str] = []
+    text = content.strip()
+    if text.startswith("```"):
+        text = _FENCE_RE.sub("", text).strip()
+        repairs.append("code_fence")
+    try:
+        return json.loads(text), repairs
+    except json.JSONDecodeError:
+        pass
+    # Prose around the object: keep the outermost {...}
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        raise GradingOutputError("Model did not return valid JSON.")
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        raise GradingOutputError("Model did not return valid JSON.")
+    repairs.append("surrounding_text")
+    return data, repairs
+
+
+def _coerce_score(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        m = _NUMBER_RE.search(value)
+        if m:
+            return float(m.group())
+    raise ValueError(value)
+
+
+def parse_grading_output(
+    content: str,
+    with_chart_analysis: bool = False,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Parse and validate a grading reply, repairing what can be repaired locally.
+    With with_chart_analysis, a missing or malformed chart_analysis is set to
+    None rather than failing the grade.
+
+    Returns (data, repairs) where repairs lists the fixes that were applied
+    (empty when the reply was valid as returned). Raises GradingOutputError
+    when the reply is unusable and only another model call can help.
+    """
+    data, repairs = _extract_json(content)
+    if not isinstance(data, dict):
+        raise GradingOutputError("Model reply is not a JSON object.")
+
+    for c in CRITERIA:
+        if c not in data:
+            raise GradingOutputError(f"Missing key: {c}")
+        if not isinstance(data[c], (int, float)) or isinstance(data[c], bool):
+            try:
+                data[c] = _coerce_score(data[c])
+            except ValueError:
+                raise GradingOutputError(f"{c} is not a number: {data[c]!r}")
+            repairs.append("numeric_string")
+        # Bands are rounded to half steps later; judge the range the same way
+        if not 0 <= round(data[c] * 2) / 2 <= 9:
+            raise GradingOutputError(f"{c} out of range (0-9): {data[c]}")
+
+    notes = data.get("notes")
+    if not isinstance(notes, dict):
+        raise GradingOutputError("Missing key: notes")
+    for c in CRITERIA:
+        if not isinstance(notes.get(c), str):
+            if c not in notes:
+                raise GradingOutputError(f"Missing note: {c}")
+            notes[c] = str(notes[c])
+            repairs.append("note_type")
+
+    if not isinstance(data.get("overall_comment"), str):
+        raise GradingOutputError("Missing key: overall_comment")
+
+    plan = data.get("improvement_plan")
+    if isinstance(plan, str) and plan.strip():
+        data["improvement_plan"] = [line.strip(" -*•") for line in plan.splitlines() if line.strip()]
+        repairs.append("improvement_plan_string")
+    elif not isinstance(plan, list) or not plan:
+        data["improvement_plan"] = list(DEFAULT_IMPROVEMENT_PLAN)
+        repairs.append("improvement_plan_default")
+
+    if with_chart_analysis and not isinstance(data.get("chart_analysis"), dict):
+        data["chart_analysis"] = None
+        repairs.append("chart_analysis_missing")
+
+    return data, sorted(set(repairs))
@@ -3,20 +3,122 @@ Image analysis module for academic_task_1.
 This module handles image processing and analysis for IELTS Writing Task 1 (Academic).
 """
 
+import asyncio
 import base64
+import hashlib
+import io
 import json
+import math
+import time
 from typing import Optional, Dict, Any, Tuple
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 
+from app.openai_client import get_async_client
+from app.result_cache import ResultCache
+
 load_dotenv()
 
+# Analyses are cached per (image bytes, VISION_MODEL, detail) and persisted to disk,
+# since a whole class usually answers the same chart.
+image_analysis_cache = ResultCache(
+    max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.getenv("IMAGE_CACHE_TTL", str(30 * 24 * 3600))),
+    cache_dir=os.getenv("IMAGE_CACHE_DIR", "./image_cache"),
+)
+
+# Image normalisation before vision calls. Vision models resize images to fit
+# 2048x2048 and then to a 768px shortest side anyway, so larger uploads only
+# cost bandwidth and base64 bloat.
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "1") == "1"
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# "auto" picks low detail when the image fits a single 512px tile
+# (nothing is lost and it costs 85 tokens); "low"/"high" force it
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto")
+
+# Analyses currently running, so concurrent requests for the same image
+# share one vision call instead of each starting their own.
+_in_flight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+def image_cache_key(image_data: bytes, vision_model: str, detail: str = "auto") -> str:
+    """
+    Cache key for an image analysis: SHA-256 of the image bytes plus the
+    model and detail level (a low-detail analysis can't stand in for a
+    high-detail one).
+    """
+    h = hashlib.sha256(image_data)
+    for part in (vision_model, detail):
+        h.update(b"\x00")
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
 
-def analyze_image_with_ai(
+async def analyze_image_with_ai(
     image_data: bytes,
     image_format: str = "jpeg",
-    api_endpoint: Optional[str] = None
+    api_endpoint: Optional[str] = None,
+    detail: str = "auto",
+) -> Dict[str, Any]:
+    """
+    Analyze an image, reusing a cached or in-flight analysis of the same bytes.
+    
+    Only completed analyses are cached; errors are returned but not stored,
+    so the next request retries the vision call.
+    
+    Args:
+        image_data: Raw image bytes
+        image_format: Format of the image (jpeg, png, etc.)
+        api_endpoint: Optional API endpoint URL (not used, kept for compatibility)
+        detail: Vision detail level ("low", "high" or "auto")
+        
+    Returns:
+        Dictionary containing analysis results (see _analyze_image_uncached)
+    """
+    key = image_cache_key(image_data, os.getenv("VISION_MODEL", "gpt-4o-mini"), detail)
+
+    cached = await image_analysis_cache.aget(key)
+    if cached is not None:
+        # No vision call was made for this request
+        cached["usage"] = {"prompt_tokens": 0, "completion_tokens": 0}
+        return cached
+
+    pending = _in_flight.get(key)
+    joined = pending is not None
+    if pending is None:
+        pending = asyncio.ensure_future(_analyze_and_store(key, image_data, image_format, detail))
+        _in_flight[key] = pending
+
+    # shield() so one client disconnecting doesn't cancel the shared call
+    result = dict(await asyncio.shield(pending))
+    if joined:
+        # Another request paid for this vision call
+        result["usage"] = {"prompt_tokens": 0, "completion_tokens": 0}
+    return result
+
+
+async def _analyze_and_store(key: str, image_data: bytes, image_format: str, detail: str) -> Dict[str, Any]:
+    """
+    Run the vision call and cache a completed analysis (disk write in a
+    worker thread). Stays registered in _in_flight until the result is
+    stored, so later requests either join it or hit the cache.
+    """
+    try:
+        result = await _analyze_image_uncached(image_data, image_format, detail=detail)
+        if result.get("analysis_status") == "completed":
+            await image_analysis_cache.aset(key, result)
+        return result
+    finally:
+        _in_flight.pop(key, None)
+
+
+async def _analyze_image_uncached(
+    image_data: bytes,
+    image_format: str = "jpeg",
+    api_endpoint: Optional[str] = None,
+    detail: str = "auto",
 ) -> Dict[str, Any]:
     """
     Analyze an image using OpenAI's vision API.
@@ -29,6 +131,7 @@ def analyze_image_with_ai(
         image_data: Raw image bytes
         image_format: Format of the image (jpeg, png, etc.)
         api_endpoint: Optional API endpoint URL (not used, kept for compatibility)
+        detail: Vision detail level ("low", "high" or "auto")
         
     Returns:
         Dictionary containing analysis results with:
@@ -40,6 +143,7 @@ def analyze_image_with_ai(
         - visual_elements: List of detected visual elements (charts, graphs, etc.)
         - key_features: Key features and trends identified
         - data_points: Specific data points extracted (if applicable)
+        - usage: prompt/completion tokens of the vision call
     """
     try:
         # Get OpenAI API key
@@ -57,8 +161,8 @@ def analyze_image_with_ai(
                 "data_points": None,
             }
         
-        # Create OpenAI client
-        client = OpenAI(api_key=api_key)
+        # Shared async client (pooled connections, does not block the event loop)
+        client = get_async_client()
         
         # Get model from environment (default to gpt-4o-mini which supports vision)
         vision_model = os.getenv("VISION_MODEL", "gpt-4o-mini")
@@ -85,7 +189,7 @@ Extract and structure the following information:
 Return your analysis in a clear, structured format that can be used to evaluate whether a candidate's written response accurately describes the visual data."""
 
         # Call OpenAI Vision API
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=vision_model,
             messages=[
                 {
@@ -98,7 +202,8 @@ Return your analysis in a clear, structured format that can be used to evaluate
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": base64_image
+                                "url": base64_image,
+                                "detail": detail,
                             }
                         }
                     ]
@@ -165,6 +270,10 @@ Return your analysis in a clear, structured format that can be used to evaluate
             "visual_elements": visual_elements,
             "key_features": key_features,
             "data_points": data_points,
+            "usage": {
+                "prompt_tokens": getattr(response.usage, "prompt_tokens", 0) or 0,
+                "completion_tokens": getattr(response.usage, "completion_tokens", 0) or 0,
+            },
         }
         
     except Exception as e:
@@ -182,6 +291,116 @@ Return your analysis in a clear, structured format that can be used to evaluate
         }
 
 
+def estimate_vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Vision input tokens for an image of this size: 85 at low detail; at high
+    detail the image is fit into 2048x2048, its shortest side scaled to 768,
+    and each 512px tile costs 170 on top of the base 85.
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def normalize_image(image_data: bytes, image_format: str) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Prepare an uploaded chart for vision calls: apply EXIF orientation, cap
+    the resolution (IMAGE_MAX_SIDE / IMAGE_MAX_SHORT_SIDE), drop metadata and
+    recompress (JPEG for photos, palette PNG for flat-colour charts).
+    The original bytes are kept when re-encoding would not make them smaller
+    and no resize was needed.
+
+    CPU-bound; call it through normalize_image_async from request handlers.
+
+    Returns:
+        (image bytes, format, report) where report has sizes, the chosen
+        vision detail level and the bytes/estimated tokens saved
+    """
+    started = time.perf_counter()
+    report: Dict[str, Any] = {"original_bytes": len(image_data), "original_format": image_format}
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        report.update({"normalized": False, "reason": "Pillow not installed", "detail": "auto", "bytes": len(image_data)})
+        return image_data, image_format, report
+
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            img.seek(0)  # first frame of an animated GIF
+            img = ImageOps.exif_transpose(img)
+            original_size = img.size
+
+            scale = min(1.0, IMAGE_MAX_SIDE / max(img.size), IMAGE_MAX_SHORT_SIDE / min(img.size))
+            resized = scale < 1.0
+            if resized:
+                img = img.resize(
+                    (max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                    Image.LANCZOS,
+                )
+
+            has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+            img = img.convert("RGBA" if has_alpha else "RGB")
+            if has_alpha:
+                # Vision models don't need transparency; flatten onto white
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[-1])
+                img = background
+
+            out = io.BytesIO()
+            # Charts and diagrams have few distinct colours and compress far
+            # better as palette PNG; photos of charts are smaller as JPEG
+            if img.getcolors(256) is not None:
+                img.quantize(256).save(out, format="PNG", optimize=True)
+                out_format = "png"
+            else:
+                img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+                out_format = "jpeg"
+            size = img.size
+    except Exception as e:
+        report.update({"normalized": False, "reason": f"decode failed: {e}", "detail": "auto", "bytes": len(image_data)})
+        return image_data, image_format, report
+
+    data = out.getvalue()
+    if not resized and len(data) >= len(image_data):
+        data, out_format = image_data, image_format
+
+    if IMAGE_DETAIL in ("low", "high"):
+        detail = IMAGE_DETAIL
+    else:
+        detail = "low" if max(size) <= 512 else "high"
+
+    original_tokens = estimate_vision_tokens(*original_size)
+    tokens = estimate_vision_tokens(*size, detail=detail)
+    report.update({
+        "normalized": True,
+        "original_size": list(original_size),
+        "size": list(size),
+        "format": out_format,
+        "bytes": len(data),
+        "bytes_saved": len(image_data) - len(data),
+        "detail": detail,
+        "estimated_tokens": tokens,
+        "estimated_tokens_saved": original_tokens - tokens,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    return data, out_format, report
+
+
+async def normalize_image_async(image_data: bytes, image_format: str) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    normalize_image() in a worker thread so decoding never blocks the event loop.
+    Returns the input unchanged when IMAGE_NORMALIZE is off.
+    """
+    if not IMAGE_NORMALIZE:
+        return image_data, image_format, {"normalized": False, "detail": "auto", "bytes": len(image_data)}
+    return await asyncio.to_thread(normalize_image, image_data, image_format)
+
+
 def encode_image_to_base64(image_data: bytes, image_format: str = "jpeg") -> str:
     """
     Encode image bytes to base64 string for API transmission.
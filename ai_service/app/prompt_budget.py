@@ -0,0 +1,151 @@
+"""
+Prompt token budgeting for the grading call.
+
+The grading prompt is assembled from named sections (system rules, scoring
+guidance, task, essay, rubric excerpts, image analysis). This module counts
+tokens per section with tiktoken and, when the total exceeds the configured
+input budget, applies trimming steps in priority order until it fits.
+
+The encoding is loaded once (warm_encoding, from a worker thread at
+startup). When tiktoken can't load it, e.g. an offline host that can't
+fetch the BPE file, counts fall back to a chars/4 estimate instead of
+failing the request.
+"""
+
+import os
+from functools import lru_cache
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import tiktoken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# "standard" sends the full scoring guidance; "compact" drops the guidance
+# block that repeats the system rules
+PROMPT_PROFILE = os.getenv("PROMPT_PROFILE", "standard")
+
+# Trimming steps in the order they are tried. The image analysis is
+# per-request; rubric excerpts and guidance belong to the system prefix that
+# is identical across requests (provider prompt caching), so they come last.
+PREFIX_TRIM_STEPS = ("rubric_overlap", "rubric_chunk", "guidance")
+TRIM_ORDER = (
+    "image_data_points",
+    "image_structured_data",
+    "image_description",
+) + PREFIX_TRIM_STEPS
+
+
+# Sections whose text is the same for every request of a task type; their
+# counts are cached across requests
+STATIC_SECTIONS = frozenset({"system", "guidance", "schema"})
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"WARNING: tiktoken encoding for {model} unavailable, estimating tokens as chars/4: {e}")
+        return None
+
+
+def warm_encoding(model: str) -> bool:
+    """
+    Load the encoding for model ahead of the first request (it may download
+    the BPE file). Returns False when counts will be estimated.
+    """
+    return _encoding(model) is not None
+
+
+def count_tokens(text: str, model: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+@lru_cache(maxsize=64)
+def _static_count(text: str, model: str) -> int:
+    return count_tokens(text, model)
+
+
+def drop_overlapping_chunks(chunks: Sequence[str], threshold: float = 0.5) -> List[str]:
+    """
+    Drop rubric chunks that mostly repeat earlier ones: either most of their
+    lines already appeared, or they start with text contained in a kept chunk
+    (the tail overlap of a sliding-window chunker).
+    """
+    kept: List[str] = []
+    seen_lines = set()
+    for chunk in chunks:
+        lines = [line.strip() for line in chunk.splitlines() if line.strip()]
+        repeated = sum(1 for line in lines if line in seen_lines)
+        head = chunk.strip()[:120]
+        if lines and repeated / len(lines) >= threshold:
+            continue
+        if head and any(head in other for other in kept):
+            continue
+        kept.append(chunk)
+        seen_lines.update(lines)
+    return kept
+
+
+def enforce_budget(
+    render: Callable[[], Dict[str, str]],
+    steps: Sequence[Tuple[str, Callable[[], bool]]],
+    model: str,
+    budget: int = PROMPT_TOKEN_BUDGET,
+) -> Tuple[Dict[str, str], Dict[str, object]]:
+    """
+    Render the prompt sections and trim until they fit the token budget.
+
+    render() returns {section_name: text}. Each step is (label, apply) where
+    apply() shrinks the state render() reads from and returns False once it
+    has nothing left to trim. Steps are tried in order; after every
+    successful step the prompt is re-rendered and the sections that changed
+    are re-counted; STATIC_SECTIONS counts are cached across calls.
+
+    Returns (sections, report) where report holds per-section token counts,
+    the total, the budget and the labels of the steps that were applied.
+    """
+    def measure(sections: Dict[str, str], previous: Dict[str, str], counts: Dict[str, int]) -> Dict[str, int]:
+        # Only sections whose text changed since the last render are re-counted
+        return {
+            name: (
+                _static_count(text, model) if name in STATIC_SECTIONS
+                else counts[name] if previous.get(name) == text
+                else count_tokens(text, model)
+            )
+            for name, text in sections.items()
+        }
+
+    sections = render()
+    counts = measure(sections, {}, {})
+    trimmed: List[str] = []
+
+    while sum(counts.values()) > budget:
+        for label, apply in steps:
+            if apply():
+                trimmed.append(label)
+                break
+        else:
+            break  # nothing left to trim; send it over budget
+        previous, sections = sections, render()
+        counts = measure(sections, previous, counts)
+
+    total = sum(counts.values())
+    report = {
+        "sections": counts,
+        "total": total,
+        "budget": budget,
+        "over_budget": total > budget,
+        "trimmed": trimmed,
+    }
+    return sections, report
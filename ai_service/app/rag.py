@@ -1,44 +1,194 @@
 import os
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def retrieve_rubric_context(task_type: str, k: int = 8) -> str:
-    try:
-        import chromadb
-        from chromadb.utils import embedding_functions
+PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "ielts_writing_rubric")
+# Read-only vector snapshot written by scripts/ingest.py. When present it is
+# served in-process with NumPy and chromadb is never imported.
+SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR", "./rag_snapshot")
+TASK_TYPES = ("academic_task_1", "general_task_1", "task_2")
+
+_lock = threading.Lock()
+_collection = None
+_snapshot = None
+# (task_type, k) -> rubric chunks, valid while the store signature matches
+_context_cache: Dict[Tuple[str, int], List[str]] = {}
+_cache_signature: Optional[Tuple] = None
+
+
+def rubric_query(task_type: str) -> str:
+    # scripts/ingest.py pre-embeds these queries into the snapshot
+    return f"IELTS {task_type} writing band descriptors rubric TR CC LR GRA"
+
+
+def _snapshot_meta_path() -> Path:
+    return Path(SNAPSHOT_DIR) / "meta.json"
+
+
+def _get_collection():
+    """
+    Open the Chroma client and rubric collection once per process.
+    """
+    global _collection
+    if _collection is None:
+        with _lock:
+            if _collection is None:
+                import chromadb
+                from chromadb.utils import embedding_functions
+
+                chroma_client = chromadb.PersistentClient(path=PERSIST_DIR)
+
+                embedder = embedding_functions.OpenAIEmbeddingFunction(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    model_name=os.getenv("EMBED_MODEL", "text-embedding-3-small"),
+                )
+
+                _collection = chroma_client.get_collection(
+                    name=COLLECTION_NAME,
+                    embedding_function=embedder
+                )
+    return _collection
+
+
+class VectorSnapshot:
+    """
+    Memory-mapped float32 embedding matrix plus document/metadata JSON.
+    Rows are L2-normalised at export, so cosine similarity is a dot product.
+    The matrix is opened with mmap, so uvicorn workers share its pages.
+    """
+
+    def __init__(self, directory: Path):
+        import numpy as np
+
+        meta = json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+        self.embed_model = meta["embed_model"]
+        self.documents: List[str] = meta["documents"]
+        self.metadatas: List[dict] = meta["metadatas"]
+        self.embeddings = np.load(directory / meta["embeddings_file"], mmap_mode="r")
+        if self.embeddings.shape[0] != len(self.documents):
+            raise ValueError("Snapshot embeddings and documents are out of sync")
 
-        persist_dir = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
-        collection_name = os.getenv("CHROMA_COLLECTION", "ielts_writing_rubric")
+        self.queries: Dict[str, int] = meta.get("queries", {})
+        self.query_embeddings = None
+        if self.queries:
+            self.query_embeddings = np.load(directory / meta["query_embeddings_file"], mmap_mode="r")
 
-        chroma_client = chromadb.Client(
-            chromadb.config.Settings(persist_directory=persist_dir)
-        )
+        task_types = np.array([m.get("task_type", "") for m in self.metadatas])
+        self._task_masks = {t: task_types == t for t in set(task_types.tolist())}
 
-        embedder = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model_name=os.getenv("EMBED_MODEL", "text-embedding-3-small"),
-        )
+    def _embed_query(self, query: str):
+        import numpy as np
 
-        collection = chroma_client.get_collection(
-            name=collection_name,
-            embedding_function=embedder
-        )
+        if query in self.queries:
+            return self.query_embeddings[self.queries[query]]
 
-        query = f"IELTS {task_type} writing band descriptors rubric TR CC LR GRA"
-        res = collection.query(
-            query_texts=[query],
-            n_results=k,
-            where={"task_type": task_type}
-        )
+        from openai import OpenAI
 
-        docs = res.get("documents", [[]])[0]
-        if not docs:
-            return ""
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        resp = client.embeddings.create(model=self.embed_model, input=[query])
+        vec = np.asarray(resp.data[0].embedding, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
 
-        rubric_context = "\n\n".join(docs)
-        print("RAG context length:", len(rubric_context))
-        return rubric_context
+    def query(self, query: str, task_type: str, k: int) -> List[str]:
+        import numpy as np
+
+        mask = self._task_masks.get(task_type)
+        if mask is None or not mask.any():
+            return []
+
+        scores = self.embeddings @ self._embed_query(query)
+        scores = np.where(mask, scores, -np.inf)
+        k = min(k, int(mask.sum()))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [self.documents[i] for i in top]
+
+
+def _get_snapshot() -> Optional[VectorSnapshot]:
+    global _snapshot
+    if _snapshot is None and _snapshot_meta_path().exists():
+        with _lock:
+            if _snapshot is None:
+                _snapshot = VectorSnapshot(Path(SNAPSHOT_DIR))
+    return _snapshot
+
+
+def _collection_signature() -> Optional[Tuple]:
+    """
+    Cheap fingerprint of the on-disk store; changes whenever ingest.py
+    rewrites the snapshot or the Chroma database (including a run with
+    --no-snapshot, which also removes the old snapshot), which invalidates
+    the cached rubric contexts.
+    """
+    signature = []
+    for path in (_snapshot_meta_path(), Path(PERSIST_DIR) / "chroma.sqlite3"):
+        try:
+            st = path.stat()
+            signature.append((str(path), st.st_mtime_ns, st.st_size))
+        except OSError:
+            continue
+    return tuple(signature) or None
+
+
+def peek_rubric_chunks(task_type: str, k: int = 8) -> Optional[List[str]]:
+    """
+    Return the cached rubric chunks for task_type, or None on a miss.
+    Never touches the network, so it is safe to call on the event loop.
+    """
+    global _cache_signature, _collection, _snapshot
+    signature = _collection_signature()
+    if signature != _cache_signature:
+        with _lock:
+            if signature != _cache_signature:
+                # A re-ingest may have recreated the collection under a new id
+                # or replaced the snapshot files
+                _context_cache.clear()
+                _collection = None
+                _snapshot = None
+                _cache_signature = signature
+        return None
+    return _context_cache.get((task_type, k))
+
+
+def retrieve_rubric_chunks(task_type: str, k: int = 8) -> List[str]:
+    """
+    Rubric chunks for task_type in relevance order (empty if RAG is unavailable).
+    """
+    cached = peek_rubric_chunks(task_type, k)
+    if cached is not None:
+        return list(cached)
+
+    try:
+        query = rubric_query(task_type)
+        snapshot = _get_snapshot()
+        if snapshot is not None:
+            docs = snapshot.query(query, task_type, k)
+        else:
+            res = _get_collection().query(
+                query_texts=[query],
+                n_results=k,
+                where={"task_type": task_type}
+            )
+            docs = res.get("documents", [[]])[0] or []
+        print("RAG context length:", sum(len(d) for d in docs))
+
+        _context_cache[(task_type, k)] = docs
+        return list(docs)
 
     except Exception:
-        return ""
+        return []
+
+
+def warm_rubric_cache(k: int = 8) -> None:
+    """
+    Open the store and precompute the context for every task type.
+    Called once at startup so no embedding call happens on the request path.
+    """
+    for task_type in TASK_TYPES:
+        retrieve_rubric_chunks(task_type, k)
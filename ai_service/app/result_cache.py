@@ -0,0 +1,221 @@
+"""
+Evaluation result cache for the AI service.
+
+Results are keyed by a SHA-256 over everything that determines the grade
+(task type, prompt, essay, image bytes, model, prompt version), so a
+resubmitted essay or a retried worker job is answered without another
+GRADE_MODEL call. Entries live in an in-process LRU with a TTL; setting
+RESULT_CACHE_DIR adds an on-disk JSON backend that survives restarts.
+Async handlers use aget/aset, which do the disk I/O in a worker thread.
+The directory is pruned of expired files, and capped at
+RESULT_CACHE_MAX_FILES, every RESULT_CACHE_PRUNE_EVERY writes.
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+RESULT_CACHE_MAX_FILES = int(os.getenv("RESULT_CACHE_MAX_FILES", "20000"))
+RESULT_CACHE_PRUNE_EVERY = int(os.getenv("RESULT_CACHE_PRUNE_EVERY", "256"))
+
+
+def make_cache_key(
+    task_type: str,
+    task_prompt: str,
+    essay: str,
+    image_bytes: Optional[bytes],
+    model: str,
+    prompt_version: str,
+    image_sha256: Optional[bytes] = None,
+) -> str:
+    """
+    Build the content-addressed key for one evaluation. Pass image_sha256
+    when the image digest is already known (computed while uploading).
+    """
+    h = hashlib.sha256()
+    for part in (task_type, task_prompt, essay, model, prompt_version):
+        data = part.encode("utf-8")
+        # Length-prefix each field so ("ab", "c") and ("a", "bc") differ
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    if image_sha256 is None and image_bytes:
+        image_sha256 = hashlib.sha256(image_bytes).digest()
+    h.update(image_sha256 or b"\x00")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU/TTL cache with an optional directory of JSON files behind it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float,
+        cache_dir: Optional[str] = None,
+        max_files: int = RESULT_CACHE_MAX_FILES,
+        prune_every: int = RESULT_CACHE_PRUNE_EVERY,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_files = max_files
+        self.prune_every = prune_every
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _get_memory(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return copy.deepcopy(value)
+                del self._entries[key]
+        return None
+
+    def _get_disk(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._read_disk(key, now)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        # Keep the original timestamp so a reload doesn't extend the TTL
+        self._remember(key, value, stored_at)
+        return copy.deepcopy(value)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self.cache_dir:
+            value = self._get_disk(key, now)
+        return value
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        value = copy.deepcopy(value)
+        self._remember(key, value, now)
+        self._write_disk(key, value, now)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        get() for async handlers: memory hits return directly, the disk
+        lookup runs in a worker thread.
+        """
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is None and self.cache_dir:
+            value = await asyncio.to_thread(self._get_disk, key, now)
+        return value
+
+    async def aset(self, key: str, value: Dict[str, Any]) -> None:
+        """
+        set() for async handlers; the disk write runs in a worker thread.
+        """
+        if self.cache_dir:
+            await asyncio.to_thread(self.set, key, value)
+        else:
+            self.set(key, value)
+
+    def _remember(self, key: str, value: Dict[str, Any], stored_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _read_disk(self, key: str, now: float) -> Optional[tuple]:
+        """
+        (stored_at, result) from disk, or None when missing or expired.
+        """
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            payload = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        stored_at = payload.get("stored_at", 0)
+        if now - stored_at > self.ttl:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return stored_at, payload.get("result")
+
+    def _write_disk(self, key: str, value: Dict[str, Any], stored_at: float) -> None:
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_text(
+                json.dumps({"stored_at": stored_at, "result": value}),
+                encoding="utf-8",
+            )
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"WARNING: could not write result cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            due = self.prune_every > 0 and self._writes % self.prune_every == 0
+        if due:
+            self.prune_disk()
+
+    def prune_disk(self) -> int:
+        """
+        Delete expired entry files, then the oldest ones beyond max_files.
+        File mtimes stand in for stored_at (entries are written once).
+        Returns the number of files removed.
+        """
+        if not self.cache_dir:
+            return 0
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        expired = [path for mtime, path in entries if now - mtime > self.ttl]
+        alive = len(entries) - len(expired)
+        overflow = [path for _, path in entries[len(expired):]][:max(0, alive - self.max_files)]
+        removed = 0
+        for path in expired + overflow:
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    ttl=RESULT_CACHE_TTL,
+    cache_dir=RESULT_CACHE_DIR,
+)
@@ -0,0 +1,120 @@
+"""
+In-memory band-descriptor index for the AI service.
+
+The rubric files under rag_data/<task_type>/<criterion>_band_<n>.md are
+already keyed by task type, criterion and band, so they can be looked up
+directly instead of through a vector query. The index is built once from
+disk and answers lookups with no embedding call and no vector database.
+"""
+
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RAG_DATA_DIR = Path(os.getenv("RAG_DATA_DIR", Path(__file__).resolve().parent.parent / "rag_data"))
+CRITERIA = ("TR", "CC", "LR", "GRA")
+
+# Where process_evaluation gets rubric context from:
+#   "rag"        - semantic vector query (default)
+#   "index"      - every descriptor for the task type from this index
+#   "index_near" - only descriptors within RUBRIC_BAND_RADIUS of the expected band
+RUBRIC_SOURCE = os.getenv("RUBRIC_SOURCE", "rag")
+RUBRIC_BAND_RADIUS = float(os.getenv("RUBRIC_BAND_RADIUS", "1.0"))
+# Used by "index_near" when the request carries no expected band
+RUBRIC_DEFAULT_BAND = float(os.getenv("RUBRIC_DEFAULT_BAND", "6.5"))
+
+_FILE_RE = re.compile(r"^(tr|cc|lr|gra|ga)[_-]band[_-]?(\d(?:\.5)?)$")
+
+_lock = threading.Lock()
+# (task_type, criterion) -> [(band, descriptor text)] sorted by band
+_index: Optional[Dict[Tuple[str, str], List[Tuple[float, str]]]] = None
+
+
+def _build_index(root: Path) -> Dict[Tuple[str, str], List[Tuple[float, str]]]:
+    index: Dict[Tuple[str, str], List[Tuple[float, str]]] = {}
+    for path in sorted(root.glob("*/*.md")):
+        m = _FILE_RE.match(path.stem.lower())
+        if not m:
+            continue
+        criterion = "GRA" if m.group(1) in ("gra", "ga") else m.group(1).upper()
+        text = path.read_text(encoding="utf-8", errors="ignore").strip()
+        if text:
+            index.setdefault((path.parent.name, criterion), []).append((float(m.group(2)), text))
+    for entries in index.values():
+        entries.sort(key=lambda entry: entry[0])
+    return index
+
+
+def load_rubric_index() -> None:
+    """
+    Build the index from RAG_DATA_DIR (called once at startup; lookups build
+    it lazily otherwise).
+    """
+    global _index
+    with _lock:
+        _index = _build_index(RAG_DATA_DIR)
+
+
+def get_descriptors(
+    task_type: str,
+    criteria: Optional[List[str]] = None,
+    band_min: float = 0.0,
+    band_max: float = 9.0,
+    center: Optional[float] = None,
+) -> List[str]:
+    """
+    Band descriptors for task_type restricted to band_min <= band <= band_max.
+
+    Without center they are grouped by criterion (TR, CC, LR, GRA) and
+    ordered by band. With center they are in relevance order: nearest band
+    first, criteria interleaved at each distance, so dropping chunks from
+    the end (prompt budget) removes the least relevant bands of every
+    criterion evenly.
+    """
+    if _index is None:
+        load_rubric_index()
+    entries = []
+    for rank, criterion in enumerate(criteria or CRITERIA):
+        for band, text in _index.get((task_type, criterion), []):
+            if band_min <= band <= band_max:
+                entries.append((band, rank, text))
+    if center is not None:
+        entries.sort(key=lambda entry: (abs(entry[0] - center), entry[0], entry[1]))
+    else:
+        entries.sort(key=lambda entry: (entry[1], entry[0]))
+    return [text for _, _, text in entries]
+
+
+def descriptors_near_band(
+    task_type: str,
+    expected_band: Optional[float] = None,
+    radius: float = RUBRIC_BAND_RADIUS,
+) -> List[str]:
+    """
+    Only the descriptors around the expected band, for every criterion,
+    in relevance order. Descriptor files stop at band 4 ("4 and below"),
+    so the window is clamped to include it for weak essays.
+    """
+    center = RUBRIC_DEFAULT_BAND if expected_band is None else expected_band
+    band_min = center - radius
+    band_max = center + radius
+    if band_max < 4.0:
+        band_max = 4.0
+    return get_descriptors(task_type, band_min=band_min, band_max=band_max, center=center)
+
+
+def lookup_rubric_chunks(task_type: str, expected_band: Optional[float] = None) -> List[str]:
+    """
+    Rubric chunks for the current RUBRIC_SOURCE index mode, most relevant
+    to the expected band (RUBRIC_DEFAULT_BAND when unknown) first.
+    """
+    if RUBRIC_SOURCE == "index_near":
+        return descriptors_near_band(task_type, expected_band)
+    center = RUBRIC_DEFAULT_BAND if expected_band is None else expected_band
+    return get_descriptors(task_type, center=center)
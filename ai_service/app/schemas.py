@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 class EvalRequest(BaseModel):
     task_type: str = Field(..., pattern="^(academic_task_1|general_task_1|task_2)$")
@@ -8,6 +8,14 @@ class EvalRequest(BaseModel):
     # Image is optional and only used for academic_task_1
     image_url: Optional[str] = Field(None, description="URL or base64 encoded image for academic_task_1")
     image_base64: Optional[str] = Field(None, description="Base64 encoded image data")
+    # Optional band estimate (e.g. the student's last result), used to pick
+    # nearby descriptors when RUBRIC_SOURCE=index_near
+    expected_band: Optional[float] = Field(None, ge=0, le=9)
+
+class BatchEvalRequest(BaseModel):
+    # Raw items, validated one by one so a bad item fails on its own line
+    # of the batch stream instead of rejecting the whole batch
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=500)
 
 class EvalResponse(BaseModel):
     overall_band: float
@@ -0,0 +1,141 @@
+"""
+Bounded readers for essay image uploads.
+
+Multipart files are streamed in chunks into a single buffer with a hard size
+limit and hashed on the fly; base64 images are size-checked before decoding
+and decoded exactly once. The digest is reused for the result cache key and
+the decoded bytes for validation, normalisation and the vision payload.
+
+Those limits only cap what is copied once the body has been received, and
+Starlette has already spooled a multipart file (or buffered a JSON body) by
+then. RequestSizeLimitMiddleware caps the request itself: a declared
+Content-Length over the limit is rejected before the body is read, and a
+chunked body is cut off with 413 as soon as it passes the limit.
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+MAX_IMAGE_UPLOAD_BYTES = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Whole request body: base64 adds a third to the image, plus essay and fields
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(MAX_IMAGE_UPLOAD_BYTES * 4 // 3 + 1024 * 1024)))
+# /evaluate/batch carries up to 500 items, each of which may hold an image
+MAX_BATCH_REQUEST_BYTES = int(os.getenv("MAX_BATCH_REQUEST_BYTES", str(64 * 1024 * 1024)))
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Image too large (limit {limit / (1024 * 1024):.1f} MB)",
+    )
+
+
+async def read_upload(
+    upload: UploadFile,
+    limit: int = MAX_IMAGE_UPLOAD_BYTES,
+) -> Tuple[bytearray, bytes]:
+    """
+    Read an uploaded file in chunks, stopping as soon as it exceeds limit.
+
+    Returns:
+        (data, sha256 digest); data is a bytearray, usable anywhere bytes are
+    """
+    # Declared size (multipart Content-Length per part) when the client sent it
+    size = getattr(upload, "size", None)
+    if size is not None and size > limit:
+        raise _too_large(limit)
+    data = bytearray()
+    digest = hashlib.sha256()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > limit:
+            raise _too_large(limit)
+        data += chunk
+        digest.update(chunk)
+    return data, digest.digest()
+
+
+def decode_base64_image(
+    value: str,
+    limit: int = MAX_IMAGE_UPLOAD_BYTES,
+) -> Tuple[bytes, str, bytes]:
+    """
+    Decode a base64 image (optionally a data URI) once.
+
+    Returns:
+        (data, base64 payload without the data URI prefix, sha256 digest).
+        The payload string can be sent to the vision API as-is when the
+        bytes are not changed afterwards.
+    """
+    _, sep, payload = value.partition(",")
+    if not sep:
+        payload = value
+    # Every 4 base64 characters decode to at most 3 bytes
+    if len(payload) // 4 * 3 > limit + 3:
+        raise _too_large(limit)
+    try:
+        data = base64.b64decode(payload)
+    except (binascii.Error, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Error processing base64 image: {str(e)}")
+    if len(data) > limit:
+        raise _too_large(limit)
+    return data, payload, hashlib.sha256(data).digest()
+
+
+def _request_too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request too large (limit {limit / (1024 * 1024):.1f} MB)",
+    )
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware that caps the request body before any handler parses it.
+
+    limit applies to every path except those listed in path_limits.
+    """
+
+    def __init__(self, app, limit: int = MAX_REQUEST_BYTES, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limit = limit
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.limit)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            error = _request_too_large(limit)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def capped_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the handler's body read, so FastAPI turns it into a 413
+                    raise _request_too_large(limit)
+            return message
+
+        await self.app(scope, capped_receive, send)
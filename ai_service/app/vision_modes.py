@@ -0,0 +1,118 @@
+"""
+How academic_task_1 charts reach the grading model.
+
+VISION_GRADING_MODE selects one of:
+  "two_call"    - separate vision analysis call, then the grading call with
+                  both the text analysis and the image (original behaviour)
+  "single_call" - no analysis call; the grading call gets the image and
+                  returns chart_analysis alongside the grade in the same JSON
+  "text_only"   - separate (cached) analysis call; the grading call gets the
+                  text analysis only, never the image
+
+Per-mode latency and token usage are collected in vision_stats so the mode
+can be chosen per deployment from real traffic.
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VISION_MODES = ("two_call", "single_call", "text_only")
+VISION_GRADING_MODE = os.getenv("VISION_GRADING_MODE", "two_call")
+if VISION_GRADING_MODE not in VISION_MODES:
+    raise RuntimeError(f"VISION_GRADING_MODE must be one of {VISION_MODES}, got {VISION_GRADING_MODE!r}")
+
+# Grading models that accept image input
+VISION_CAPABLE_MODELS = ("gpt-4o", "gpt-4o-mini", "gpt-4-vision-preview")
+
+
+def effective_vision_mode(grade_model: str) -> str:
+    """
+    VISION_GRADING_MODE, downgraded to text_only when the grading model
+    cannot take the image.
+    """
+    if VISION_GRADING_MODE != "text_only" and grade_model not in VISION_CAPABLE_MODELS:
+        return "text_only"
+    return VISION_GRADING_MODE
+
+
+def usage_dict(usage: Any) -> Dict[str, int]:
+    """
+    Token counts from an OpenAI usage object (zeros when it is missing).
+    """
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def chart_analysis_to_result(
+    chart: Optional[Dict[str, Any]],
+    image_format: str,
+    image_size_bytes: int,
+) -> Dict[str, Any]:
+    """
+    Shape the chart_analysis returned by a single_call grade like an
+    analyze_image_with_ai result, so responses look the same in every mode.
+    """
+    if not chart:
+        return {
+            "image_received": True,
+            "image_format": image_format,
+            "image_size_bytes": image_size_bytes,
+            "analysis_status": "error",
+            "description": "Grading model returned no chart analysis",
+            "extracted_data": None,
+            "visual_elements": None,
+            "key_features": None,
+            "data_points": None,
+        }
+    return {
+        "image_received": True,
+        "image_format": image_format,
+        "image_size_bytes": image_size_bytes,
+        "analysis_status": "completed",
+        "description": chart.get("summary", ""),
+        "extracted_data": chart,
+        "visual_elements": [chart.get("visual_type", "")],
+        "key_features": chart.get("key_features") or None,
+        "data_points": chart.get("data_points") or None,
+    }
+
+
+class VisionStats:
+    """
+    Running totals per mode: graded requests, wall time of the analysis and
+    grading calls, and the tokens they used (cached analyses cost 0).
+    """
+
+    _FIELDS = ("analysis_ms", "grading_ms", "total_ms", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, report: Dict[str, Any]) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(mode, {"requests": 0, **{f: 0.0 for f in self._FIELDS}})
+            totals["requests"] += 1
+            for field in self._FIELDS:
+                totals[field] += report.get(field) or 0
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-mode averages, e.g. {"single_call": {"requests": 12, "total_ms": ...}}.
+        """
+        with self._lock:
+            out = {}
+            for mode, totals in self._totals.items():
+                n = totals["requests"]
+                out[mode] = {"requests": n, **{f"avg_{f}": round(totals[f] / n, 1) for f in self._FIELDS}}
+            return out
+
+
+vision_stats = VisionStats()
@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for a running AI service.
+
+Fires the /evaluate payload at increasing concurrency levels and prints
+requests/second and latency per level. With a non-blocking evaluation path,
+throughput should grow with concurrency until the model API becomes the limit.
+
+Each request gets a unique nonce appended to its task prompt, so it misses
+the result cache and measures real grading. Pass --cache-hits to send the
+payload unchanged and measure the cached path instead.
+
+Usage:
+    python scripts/bench_concurrency.py --url http://127.0.0.1:8000 --levels 1,4,16,32
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def with_nonce(payload: dict) -> dict:
+    # Changes the result cache key without meaningfully changing the task
+    return {**payload, "task_prompt": f"{payload.get('task_prompt', '')}\n(ref {uuid.uuid4().hex[:12]})"}
+
+
+async def run_level(
+    client: httpx.AsyncClient,
+    url: str,
+    payload: dict,
+    concurrency: int,
+    requests_per_worker: int,
+    cache_hits: bool = False,
+):
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in range(requests_per_worker):
+            start = time.perf_counter()
+            try:
+                body = payload if cache_hits else with_nonce(payload)
+                r = await client.post(f"{url}/evaluate", json=body)
+                r.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--payload", default=str(BASE_DIR / "payload.json"))
+    parser.add_argument("--levels", default="1,4,16")
+    parser.add_argument("--requests-per-worker", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--cache-hits", action="store_true", help="send the payload unchanged (measures cache hits)")
+    args = parser.parse_args()
+
+    payload = json.loads(Path(args.payload).read_text(encoding="utf-8"))
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        print(f"{'concurrency':>11} {'ok':>5} {'err':>5} {'req/s':>8} {'p50 s':>8} {'max s':>8}")
+        for level in levels:
+            latencies, errors, elapsed = await run_level(
+                client, args.url, payload, level, args.requests_per_worker, args.cache_hits
+            )
+            throughput = len(latencies) / elapsed if elapsed else 0.0
+            p50 = statistics.median(latencies) if latencies else 0.0
+            worst = max(latencies) if latencies else 0.0
+            print(f"{level:>11} {len(latencies):>5} {errors:>5} {throughput:>8.2f} {p50:>8.2f} {worst:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+"""
+Micro-benchmark for the score/comment consistency check.
+
+Compares the rules engine in app/consistency.py with the original
+keyword-loop implementation on randomly generated grading results, checks
+that both produce identical adjustments, and prints results/second for
+single calls and for the batch API.
+
+Usage:
+    python scripts/bench_consistency.py --results 20000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from app.consistency import DEFAULT_RULES, ConsistencyEngine  # noqa: E402
+from app.grading import round_to_half  # noqa: E402
+
+FILLER = [
+    "The response", "addresses the task", "with some", "ideas that are",
+    "paragraphing is", "vocabulary shows", "errors in", "sentence forms",
+    "overall the essay", "linking devices",
+]
+
+
+def legacy_validate(
+    scores: Dict[str, float],
+    notes: Dict[str, str],
+    overall_comment: str
+) -> Tuple[Dict[str, float], bool]:
+    """
+    The pre-engine implementation, kept verbatim as the baseline.
+    """
+    positive_keywords = [
+        "accurate", "accurately", "well-structured", "well organized",
+        "effective", "effectively", "clear", "comprehensive", "good",
+        "appropriate", "varied", "mostly correct", "competent",
+        "excellent", "outstanding", "very good", "strong"
+    ]
+    
+    very_positive_keywords = [
+        "excellent", "outstanding", "very good", "strong", "impressive"
+    ]
+    
+    negative_keywords = [
+        "major", "significant", "serious", "frequent", "many errors",
+        "poor", "weak", "inadequate", "limited", "fails"
+    ]
+    
+    adjusted_scores = scores.copy()
+    was_adjusted = False
+    
+    # Check each criterion
+    for criterion in ["TR", "CC", "LR", "GRA"]:
+        score = scores[criterion]
+        note = notes.get(criterion, "").lower()
+        comment_lower = overall_comment.lower()
+        
+        # Count positive indicators
+        positive_count = sum(1 for keyword in positive_keywords if keyword in note or keyword in comment_lower)
+        very_positive_count = sum(1 for keyword in very_positive_keywords if keyword in note or keyword in comment_lower)
+        negative_count = sum(1 for keyword in negative_keywords if keyword in note)
+        
+        # Only adjust if there's a CLEAR mismatch (e.g., "excellent" with score < 5.0)
+        # Don't force all positive comments to be >= 6.0 - allow natural variation
+        if very_positive_count > 0 and score < 5.0:
+            # Very positive language with very low score is a clear mismatch
+            adjusted_scores[criterion] = max(5.5, score)
+            was_adjusted = True
+        elif positive_count > 0 and score < 4.0:
+            # Positive language with extremely low score is a mismatch
+            adjusted_scores[criterion] = max(4.5, score)
+            was_adjusted = True
+        
+        # If note is negative but score is high, check if adjustment needed
+        if negative_count >= 2 and score > 5.5:
+            # Only adjust if there are clear major problems mentioned
+            if any(keyword in note for keyword in ["major", "significant", "serious", "fails"]):
+                if score > 5.5:
+                    adjusted_scores[criterion] = min(5.5, score)
+                    was_adjusted = True
+    
+    # Only adjust overall if there's an extreme mismatch
+    # Don't force positive comments to have >= 6.0 average - allow natural scoring
+    overall_very_positive = any(keyword in overall_comment.lower() for keyword in very_positive_keywords)
+    overall_negative = any(keyword in overall_comment.lower() for keyword in ["poor", "weak", "inadequate", "fails", "does not meet"])
+    
+    if overall_very_positive:
+        avg_score = sum(adjusted_scores.values()) / len(adjusted_scores)
+        # Only boost if average is extremely low (< 4.0) for very positive comments
+        if avg_score < 4.0:
+            boost_factor = 4.5 / avg_score
+            for criterion in adjusted_scores:
+                adjusted_scores[criterion] = min(9.0, adjusted_scores[criterion] * boost_factor)
+            was_adjusted = True
+    
+    # Round to half steps
+    for criterion in adjusted_scores:
+        adjusted_scores[criterion] = round_to_half(adjusted_scores[criterion])
+    
+    return adjusted_scores, was_adjusted
+
+
+def make_results(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    words = sorted(set().union(*map(set, DEFAULT_RULES["keyword_sets"].values())))
+
+    def sentence(n_words: int) -> str:
+        # Mostly neutral phrasing with the occasional rubric keyword, like real notes
+        return " ".join(
+            rng.choice(words) if rng.random() < 0.15 else rng.choice(FILLER)
+            for _ in range(n_words)
+        ).capitalize() + "."
+
+    results = []
+    for _ in range(n):
+        scores = {c: rng.choice([x / 2 for x in range(0, 19)]) for c in ("TR", "CC", "LR", "GRA")}
+        notes = {c: sentence(rng.randint(8, 25)) for c in scores}
+        comment = " ".join(sentence(rng.randint(8, 16)) for _ in range(rng.randint(2, 4)))
+        results.append((scores, notes, comment))
+    return results
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=20000)
+    args = parser.parse_args()
+
+    results = make_results(args.results)
+    engine = ConsistencyEngine()
+
+    mismatches = sum(
+        1 for scores, notes, comment in results
+        if legacy_validate(scores, notes, comment) != engine.check(scores, notes, comment)
+    )
+
+    legacy_s = timed(lambda: [legacy_validate(*r) for r in results])
+    engine_s = timed(lambda: [engine.check(*r) for r in results])
+    batch_s = timed(lambda: engine.check_batch(results))
+
+    n = len(results)
+    print(f"Results: {n}  mismatches vs legacy: {mismatches}")
+    print(f"{'implementation':<16} {'seconds':>8} {'results/s':>11} {'speedup':>8}")
+    for name, secs in (("legacy", legacy_s), ("engine", engine_s), ("engine batch", batch_s)):
+        print(f"{name:<16} {secs:>8.3f} {n / secs:>11.0f} {legacy_s / secs:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
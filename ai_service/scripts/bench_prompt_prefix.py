@@ -0,0 +1,104 @@
+"""
+Prompt-prefix benchmark for the grading prompt.
+
+Builds grading messages for several essays of the same task type, once with
+the current layout (static rules, guidance, schema and rubric first; task and
+essay last) and once with the old layout (essay in the middle of the user
+message), and prints how many leading bytes of the serialized request are
+identical across requests. Provider-side prompt caching can only reuse that
+shared prefix. Runs locally: no API calls, rubric taken from rag_data.
+
+Usage:
+    python scripts/bench_prompt_prefix.py --requests 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from app.prompts import (  # noqa: E402
+    assemble_messages,
+    essay_block,
+    rubric_block,
+    static_sections,
+    task_block,
+)
+from app.rubric_index import get_descriptors  # noqa: E402
+
+GRADE_MODEL = os.getenv("GRADE_MODEL", "gpt-4o-mini")
+
+
+def build_sections(task_type: str, task_prompt: str, essay: str):
+    static = dict(static_sections(task_type))
+    return {
+        "system": static["system"],
+        "guidance": static["guidance"],
+        "schema": static["schema"],
+        "rubric": rubric_block(get_descriptors(task_type)),
+        "task": task_block(task_type, task_prompt),
+        "image": "",
+        "essay": essay_block(essay),
+    }
+
+
+def current_layout(sections):
+    return assemble_messages(sections)
+
+
+def legacy_layout(sections):
+    # Pre-refactor order: only the system rules are static, the essay sits
+    # in the middle of the user message ahead of rubric and guidance
+    user = (
+        sections["task"] + sections["image"] + sections["essay"]
+        + sections["rubric"] + sections["guidance"] + sections["schema"]
+    )
+    return sections["system"], user
+
+
+def serialize(system: str, user: str) -> bytes:
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+    return json.dumps({"model": GRADE_MODEL, "messages": messages}).encode("utf-8")
+
+
+def common_prefix_len(a: bytes, b: bytes) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payload", default=str(BASE_DIR / "payload.json"))
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = json.loads(Path(args.payload).read_text(encoding="utf-8"))
+    # Different students answering the same task: vary the essay only
+    essays = [f"Candidate {i}. {payload['essay']}" for i in range(args.requests)]
+
+    start = time.perf_counter()
+    built = [build_sections(payload["task_type"], payload["task_prompt"], e) for e in essays]
+    build_ms = (time.perf_counter() - start) * 1000 / len(built)
+
+    print(f"{'layout':<8} {'bytes/req':>10} {'shared prefix':>14} {'shared %':>9}")
+    for name, layout in (("legacy", legacy_layout), ("current", current_layout)):
+        bodies = [serialize(*layout(s)) for s in built]
+        prefix = min(common_prefix_len(bodies[0], b) for b in bodies[1:]) if len(bodies) > 1 else len(bodies[0])
+        avg = sum(len(b) for b in bodies) / len(bodies)
+        print(f"{name:<8} {avg:>10.0f} {prefix:>14} {100 * prefix / avg:>8.1f}%")
+    print(f"Prompt build time: {build_ms:.3f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 import os
 import re
+import json
+import time
+import random
 import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from dotenv import load_dotenv
 
 import chromadb
+import numpy as np
+import openai
+import tiktoken
 from chromadb.utils import embedding_functions
 
 load_dotenv()
@@ -12,11 +20,38 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 RAG_DIR = BASE_DIR / "rag_data"
 PERSIST_DIR = BASE_DIR / "chroma_db"
+MANIFEST_PATH = PERSIST_DIR / "ingest_manifest.json"
+SNAPSHOT_DIR = BASE_DIR / "rag_snapshot"
+TASK_TYPES = ("academic_task_1", "general_task_1", "task_2")
 
 COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "ielts_writing_rubric")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Embedding requests are capped by total tokens and inputs per call
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "100000"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "1000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = 6
+# Below this many files, a process pool costs more than it saves
+PARALLEL_CHUNKING_MIN_FILES = 64
+
+ENCODING = tiktoken.get_encoding("cl100k_base")
+
+# Chunk size for the structure-aware chunker; bump CHUNKER_VERSION whenever
+# chunking changes so incremental runs re-chunk files whose text is unchanged
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+CHUNKER_VERSION = "md-tokens-1"
+# Chunk ids are sha1(source path relative to ai_service, chunk text, nth
+# repeat of that text in the file); they don't depend on position, so
+# inserting a chunk leaves the ids of the others unchanged. Bumping
+# ID_SCHEME re-embeds every file once on the next run: the move to this
+# scheme (from absolute paths and positional ids) is such a one-off migration.
+ID_SCHEME = 2
+
+HEADING_RE = re.compile(r"^#{1,6}\s")
+BULLET_RE = re.compile(r"^[-*+]\s|^\d+[.)]\s")
+
 if not OPENAI_API_KEY:
     raise RuntimeError("Missing OPENAI_API_KEY in .env")
 
@@ -34,6 +69,84 @@ def chunk_text(text: str, max_chars: int = 1400, overlap: int = 200):
         i += step
     return chunks
 
+def count_tokens(text: str):
+    return len(ENCODING.encode(text))
+
+def split_units(text: str):
+    """
+    Split markdown into (heading, unit) pairs. A unit is a paragraph or a
+    top-level bullet together with its indented sub-bullets; heading is the
+    nearest markdown heading (or a leading title line) above it.
+    """
+    units = []
+    heading = ""
+    current = []
+
+    def flush():
+        if current:
+            units.append((heading, "\n".join(current).strip()))
+            current.clear()
+
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        is_title = i == 0 and stripped and not BULLET_RE.match(stripped)
+        if HEADING_RE.match(stripped) or is_title:
+            flush()
+            heading = stripped
+        elif not stripped:
+            flush()
+        elif BULLET_RE.match(line):
+            # A new top-level bullet starts a new descriptor
+            flush()
+            current.append(line.rstrip())
+        else:
+            current.append(line.rstrip())
+    flush()
+    return units
+
+def split_oversized(unit: str, max_tokens: int):
+    tokens = ENCODING.encode(unit)
+    return [
+        ENCODING.decode(tokens[i:i + max_tokens]).strip()
+        for i in range(0, len(tokens), max_tokens)
+    ]
+
+def chunk_markdown(text: str, max_tokens: int = CHUNK_MAX_TOKENS):
+    """
+    Structure-aware chunker: never cuts inside a band-descriptor bullet,
+    starts a new chunk at every heading, packs units up to max_tokens and
+    uses no overlap. Each chunk repeats its section heading so it stands
+    alone in retrieval. Returns a list of (chunk, token_count).
+    """
+    text = text.replace("\r\n", "\n")
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+
+    chunks = []
+    section, body, body_tokens = None, [], 0
+
+    def flush():
+        if body:
+            chunk = "\n".join(([section] if section else []) + body)
+            chunks.append((chunk, count_tokens(chunk)))
+
+    for heading, unit in split_units(text):
+        unit_tokens = count_tokens(unit)
+        heading_tokens = count_tokens(heading) if heading else 0
+        if heading != section or body_tokens + unit_tokens + heading_tokens > max_tokens:
+            flush()
+            section, body, body_tokens = heading, [], 0
+        if unit_tokens + heading_tokens > max_tokens:
+            for piece in split_oversized(unit, max(1, max_tokens - heading_tokens)):
+                body = [piece]
+                flush()
+            body, body_tokens = [], 0
+            continue
+        body.append(unit)
+        body_tokens += unit_tokens
+    flush()
+    return chunks
+
 def parse_band(stem: str):
     m = re.search(r"band[_-]?(\d(\.5)?)", stem.lower())
     return float(m.group(1)) if m else None
@@ -62,14 +175,267 @@ def parse_task_type(path: Path):
         return "common"
     return "unknown"
 
-def stable_id(file_path: Path, chunk_index: int, chunk: str):
+def stable_id(source_file: str, chunk: str, occurrence: int = 0):
     h = hashlib.sha1()
-    h.update(str(file_path).encode("utf-8"))
-    h.update(str(chunk_index).encode("utf-8"))
-    h.update(chunk.encode("utf-8"))
+    for part in (source_file, hashlib.sha256(chunk.encode("utf-8")).hexdigest(), str(occurrence)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
     return h.hexdigest()
 
+def file_hash(raw: str):
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def load_manifest():
+    """
+    Manifest of the last ingest: source_file -> {"sha256": ..., "ids": [...]}.
+    """
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest):
+    tmp = MANIFEST_PATH.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, MANIFEST_PATH)
+
+def build_file_chunks(path: Path, raw: str):
+    """
+    Chunk one source file into (ids, docs, metas).
+    """
+    source_file = path.relative_to(BASE_DIR).as_posix()
+    task_type = parse_task_type(path)
+    criterion = parse_criterion(path.stem)
+    band = parse_band(path.stem)
+
+    ids, docs, metas = [], [], []
+    seen = {}
+    for idx, (chunk, n_tokens) in enumerate(chunk_markdown(raw)):
+        meta = {
+            "task_type": task_type,
+            "source_file": source_file,
+            "chunk_index": idx,
+            "tokens": n_tokens,
+        }
+        if criterion:
+            meta["criterion"] = criterion
+        if band is not None:
+            meta["band"] = band
+
+        docs.append(chunk)
+        metas.append(meta)
+        # Identical chunks in one file still need distinct ids
+        occurrence = seen.get(chunk, 0)
+        seen[chunk] = occurrence + 1
+        ids.append(stable_id(source_file, chunk, occurrence))
+    return ids, docs, metas
+
+def read_and_chunk(path: Path):
+    """
+    Read, hash and chunk one file. Runs in a worker process for large corpora.
+    Returns (source_file, sha256, ids, docs, metas), or None for empty files.
+    """
+    raw = path.read_text(encoding="utf-8", errors="ignore").strip()
+    if not raw:
+        return None
+    ids, docs, metas = build_file_chunks(path, raw)
+    return path.relative_to(BASE_DIR).as_posix(), file_hash(raw), ids, docs, metas
+
+def iter_chunked_files(files, jobs: int):
+    if jobs > 1 and len(files) >= PARALLEL_CHUNKING_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield from pool.map(read_and_chunk, files, chunksize=16)
+    else:
+        yield from map(read_and_chunk, files)
+
+def make_token_batches(docs):
+    """
+    Group chunk indexes into batches that stay under EMBED_BATCH_TOKENS and
+    EMBED_BATCH_SIZE. Returns (batches, total_tokens).
+    """
+    batches, current, current_tokens, total = [], [], 0, 0
+    for i, n_tokens in enumerate(len(t) for t in ENCODING.encode_batch(docs)):
+        total += n_tokens
+        if current and (current_tokens + n_tokens > EMBED_BATCH_TOKENS or len(current) >= EMBED_BATCH_SIZE):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n_tokens
+    if current:
+        batches.append(current)
+    return batches, total
+
+def embed_batch(client: openai.OpenAI, texts):
+    """
+    Embed one batch, backing off exponentially on rate limits and transient errors.
+    """
+    for attempt in range(EMBED_MAX_RETRIES):
+        try:
+            resp = client.embeddings.create(model=EMBED_MODEL, input=texts)
+            return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+        except (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError):
+            if attempt == EMBED_MAX_RETRIES - 1:
+                raise
+            time.sleep(min(60, 2 ** attempt) + random.random())
+
+def embed_and_upsert(collection, ids, docs, metas):
+    """
+    Embed token-sized batches concurrently and upsert each batch as it lands.
+    """
+    batches, total_tokens = make_token_batches(docs)
+    client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+    start = time.perf_counter()
+    done_chunks = 0
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(embed_batch, client, [docs[i] for i in batch]): batch
+            for batch in batches
+        }
+        for fut in as_completed(futures):
+            batch = futures[fut]
+            collection.upsert(
+                ids=[ids[i] for i in batch],
+                documents=[docs[i] for i in batch],
+                metadatas=[metas[i] for i in batch],
+                embeddings=fut.result(),
+            )
+            done_chunks += len(batch)
+            elapsed = time.perf_counter() - start
+            print(
+                f"Embedded {done_chunks}/{len(docs)} chunks "
+                f"({done_chunks / elapsed if elapsed else 0:.1f} chunks/s)"
+            )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Embedding: {len(docs)} chunks, {total_tokens} tokens, {len(batches)} batches "
+        f"in {elapsed:.2f}s ({total_tokens / elapsed if elapsed else 0:.0f} tokens/s)"
+    )
+
+def rubric_query(task_type: str):
+    # Must match app/rag.py rubric_query(); embedded here so serving needs no
+    # embedding call
+    return f"IELTS {task_type} writing band descriptors rubric TR CC LR GRA"
+
+def normalise_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+def export_snapshot(collection):
+    """
+    Write the read-only snapshot served by app/rag.py: a float32 matrix of
+    L2-normalised embeddings (.npy, opened with mmap) plus documents and
+    metadata in meta.json. meta.json is replaced last, so readers never see
+    a half-written snapshot.
+    """
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    embeddings = normalise_rows(np.asarray(data["embeddings"], dtype=np.float32).reshape(len(data["ids"]), -1))
+
+    queries = [rubric_query(t) for t in TASK_TYPES]
+    client = openai.OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    query_embeddings = normalise_rows(np.asarray(embed_batch(client, queries), dtype=np.float32))
+
+    for name, matrix in (("embeddings.npy", embeddings), ("query_embeddings.npy", query_embeddings)):
+        tmp = SNAPSHOT_DIR / f"{name}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp, SNAPSHOT_DIR / name)
+
+    meta = {
+        "collection": COLLECTION_NAME,
+        "embed_model": EMBED_MODEL,
+        "embeddings_file": "embeddings.npy",
+        "query_embeddings_file": "query_embeddings.npy",
+        "ids": data["ids"],
+        "documents": data["documents"],
+        "metadatas": data["metadatas"],
+        "queries": {q: i for i, q in enumerate(queries)},
+    }
+    tmp = SNAPSHOT_DIR / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, SNAPSHOT_DIR / "meta.json")
+
+    print(f"Snapshot: {embeddings.shape[0]} x {embeddings.shape[1]} float32 in {SNAPSHOT_DIR}")
+
+def remove_snapshot():
+    """
+    Remove a snapshot left by an earlier run. app/rag.py serves the snapshot
+    whenever meta.json exists, so after a --no-snapshot run it would
+    otherwise keep answering from the old vectors instead of the rebuilt
+    collection.
+    """
+    meta = SNAPSHOT_DIR / "meta.json"
+    if meta.exists():
+        meta.unlink()
+        for name in ("embeddings.npy", "query_embeddings.npy"):
+            (SNAPSHOT_DIR / name).unlink(missing_ok=True)
+        print(f"Removed stale snapshot in {SNAPSHOT_DIR} (--no-snapshot); the API will query Chroma")
+
+def list_source_files():
+    files = list(RAG_DIR.rglob("*.md")) + list(RAG_DIR.rglob("*.txt"))
+    return sorted(f for f in files if f.is_file())
+
+def compare_chunkers(files):
+    """
+    Report total corpus tokens under the legacy character chunker and the
+    structure-aware token chunker.
+    """
+    legacy_chunks = legacy_tokens = new_chunks = new_tokens = raw_tokens = 0
+    for path in files:
+        raw = path.read_text(encoding="utf-8", errors="ignore").strip()
+        if not raw:
+            continue
+        raw_tokens += count_tokens(raw)
+        legacy = chunk_text(raw)
+        legacy_chunks += len(legacy)
+        legacy_tokens += sum(count_tokens(c) for c in legacy)
+        chunks = chunk_markdown(raw)
+        new_chunks += len(chunks)
+        new_tokens += sum(n for _, n in chunks)
+
+    print(f"Source text: {raw_tokens} tokens in {len(files)} files")
+    print(f"{'chunker':<22} {'chunks':>7} {'tokens':>8} {'avg/chunk':>10} {'vs source':>10}")
+    for name, n_chunks, n_tokens in [
+        ("chars 1400/200", legacy_chunks, legacy_tokens),
+        (f"markdown {CHUNK_MAX_TOKENS} tokens", new_chunks, new_tokens),
+    ]:
+        avg = n_tokens / n_chunks if n_chunks else 0
+        ratio = n_tokens / raw_tokens if raw_tokens else 0
+        print(f"{name:<22} {n_chunks:>7} {n_tokens:>8} {avg:>10.1f} {ratio:>9.2f}x")
+
 def main():
+    parser = argparse.ArgumentParser(description="Ingest rag_data into the Chroma rubric collection.")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="drop the collection and re-embed everything (default: incremental update)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes for reading and chunking large corpora",
+    )
+    parser.add_argument(
+        "--no-snapshot",
+        dest="snapshot",
+        action="store_false",
+        help="skip exporting the mmap vector snapshot used by the API (an old one is removed)",
+    )
+    parser.add_argument(
+        "--compare-chunkers",
+        action="store_true",
+        help="print corpus token counts under each chunker and exit",
+    )
+    args = parser.parse_args()
+
+    if args.compare_chunkers:
+        compare_chunkers(list_source_files())
+        return
+
     if not RAG_DIR.exists():
         raise RuntimeError(f"Missing rag_data folder: {RAG_DIR}")
 
@@ -82,61 +448,91 @@ def main():
         model_name=EMBED_MODEL
     )
 
-    existing = [c.name for c in chroma_client.list_collections()]
-    if COLLECTION_NAME in existing:
-        chroma_client.delete_collection(COLLECTION_NAME)
+    if args.rebuild:
+        existing = [c.name for c in chroma_client.list_collections()]
+        if COLLECTION_NAME in existing:
+            chroma_client.delete_collection(COLLECTION_NAME)
+        manifest = {}
+    else:
+        manifest = load_manifest()
 
+    # Incremental updates never drop the collection, so the serving path keeps
+    # answering from the old chunks until the new ones are upserted.
     collection = chroma_client.get_or_create_collection(
         name=COLLECTION_NAME,
         embedding_function=embedder
     )
 
-    files = list(RAG_DIR.rglob("*.md")) + list(RAG_DIR.rglob("*.txt"))
-    files = [f for f in files if f.is_file()]
-
+    files = list_source_files()
     if not files:
         print(f"No .md/.txt files found in {RAG_DIR}")
         return
 
+    new_manifest = {}
     docs, metas, ids = [], [], []
-    ingested_files = 0
+    changed_files = unchanged_files = 0
+    chunk_start = time.perf_counter()
 
-    for path in files:
-        raw = path.read_text(encoding="utf-8", errors="ignore").strip()
-        if not raw:
+    for chunked in iter_chunked_files(files, args.jobs):
+        if chunked is None:
             continue
 
-        task_type = parse_task_type(path)
-        criterion = parse_criterion(path.stem)
-        band = parse_band(path.stem)
-
-        chunks = chunk_text(raw)
-        for idx, chunk in enumerate(chunks):
-            meta = {
-                "task_type": task_type,
-                "source_file": str(path.relative_to(BASE_DIR)),
-                "chunk_index": idx,
-            }
-            if criterion:
-                meta["criterion"] = criterion
-            if band is not None:
-                meta["band"] = band
-
-            docs.append(chunk)
-            metas.append(meta)
-            ids.append(stable_id(path, idx, chunk))
-
-        ingested_files += 1
-
-    if not docs:
-        print("No content ingested (all files empty?)")
-        return
+        source_file, digest, file_ids, file_docs, file_metas = chunked
+        previous = manifest.get(source_file)
+        if (
+            previous
+            and previous.get("sha256") == digest
+            and previous.get("chunker") == CHUNKER_VERSION
+            and previous.get("id_scheme") == ID_SCHEME
+        ):
+            new_manifest[source_file] = previous
+            unchanged_files += 1
+            continue
+
+        # stable_id hashes the chunk text, not its position, so chunks that
+        # survived an edit keep their id and are not re-embedded; only their
+        # metadata (chunk_index may have shifted) is refreshed
+        known = set(previous["ids"]) if previous and previous.get("id_scheme") == ID_SCHEME else set()
+        kept_ids, kept_metas = [], []
+        for cid, doc, meta in zip(file_ids, file_docs, file_metas):
+            if cid in known:
+                kept_ids.append(cid)
+                kept_metas.append(meta)
+            else:
+                ids.append(cid)
+                docs.append(doc)
+                metas.append(meta)
+        if kept_ids:
+            collection.update(ids=kept_ids, metadatas=kept_metas)
+        new_manifest[source_file] = {
+            "sha256": digest,
+            "chunker": CHUNKER_VERSION,
+            "id_scheme": ID_SCHEME,
+            "ids": file_ids,
+        }
+        changed_files += 1
+
+    print(f"Read and chunked {len(files)} files in {time.perf_counter() - chunk_start:.2f}s")
+
+    if ids:
+        embed_and_upsert(collection, ids, docs, metas)
+
+    # Delete chunks that no longer belong to any source file (edited chunks,
+    # removed files, or ids left over from a run without a manifest)
+    wanted = {cid for entry in new_manifest.values() for cid in entry["ids"]}
+    stale = [cid for cid in collection.get(include=[])["ids"] if cid not in wanted]
+    if stale:
+        collection.delete(ids=stale)
 
-    collection.add(documents=docs, metadatas=metas, ids=ids)
+    save_manifest(new_manifest)
+    if args.snapshot:
+        export_snapshot(collection)
+    else:
+        remove_snapshot()
 
     print(f"Collection: {COLLECTION_NAME}")
-    print(f"Files ingested: {ingested_files}")
-    print(f"Chunks stored: {len(docs)}")
+    print(f"Files changed/new: {changed_files}, unchanged: {unchanged_files}")
+    print(f"Chunks embedded: {len(ids)}, deleted: {len(stale)}")
     print(f"DB location: {PERSIST_DIR}")
     print(f"Collection count: {collection.count()}")
 
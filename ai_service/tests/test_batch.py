@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main
+
+GOOD = {"task_type": "task_2", "task_prompt": "Discuss both views.", "essay": "word " * 30}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    graded = []
+
+    async def fake_evaluation(**kwargs):
+        graded.append(kwargs)
+        return {"overall_band": 6.0}
+
+    monkeypatch.setattr(main, "process_evaluation", fake_evaluation)
+    monkeypatch.setattr(main, "RUBRIC_SOURCE", "index")
+    client = TestClient(main.app)
+    client.graded = graded
+    return client
+
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_invalid_item_fails_alone(client):
+    response = client.post("/evaluate/batch", json={"items": [GOOD, {"task_type": "task_3"}, GOOD]})
+    assert response.status_code == 200
+    results = {line["index"]: line for line in lines(response) if "index" in line}
+    assert results[0]["ok"] and results[2]["ok"]
+    assert results[1]["ok"] is False and results[1]["status_code"] == 422
+    assert "task_type" in results[1]["error"] and "essay" in results[1]["error"]
+    assert lines(response)[-1] == {"done": True, "total": 3, "succeeded": 2, "failed": 1}
+    assert len(client.graded) == 2
+
+
+def test_batch_size_is_still_capped(client):
+    assert client.post("/evaluate/batch", json={"items": []}).status_code == 422
+    assert client.post("/evaluate/batch", json={"items": [GOOD] * 501}).status_code == 422
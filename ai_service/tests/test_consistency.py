@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from app.consistency import CRITERIA, ConsistencyEngine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+from bench_consistency import legacy_validate, make_results  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return ConsistencyEngine()
+
+
+def scores(value):
+    return {c: value for c in CRITERIA}
+
+
+def test_case_folding_that_changes_length(engine):
+    # "İ".lower() is two characters; offsets must not drift between texts
+    comment = "İstanbul İzmir İİİİİİİ: poor, weak"
+    assert engine.check(scores(7.0), {}, comment) == (scores(7.0), False)
+    assert engine.scan("İ" * 10 + " excellent") == {"excellent"}
+    assert engine.scan("x") == frozenset()
+
+
+def test_keywords_in_one_note_stay_with_that_criterion(engine):
+    notes = {"TR": "İ" * 10 + " Excellent development.", "CC": "Adequate."}
+    adjusted, was_adjusted = engine.check(scores(4.0), notes, "")
+    assert was_adjusted
+    assert adjusted["TR"] == 5.5
+    assert adjusted["CC"] == 4.0
+
+
+def test_matches_are_substrings(engine):
+    assert engine.scan("Ideas are EFFECTIVELY linked") == {"effective", "effectively"}
+
+
+def test_severe_negative_note_lowers_high_score(engine):
+    notes = {"GRA": "Frequent and serious errors."}
+    adjusted, was_adjusted = engine.check(scores(7.0), notes, "")
+    assert was_adjusted
+    assert adjusted["GRA"] == 5.5
+    assert adjusted["TR"] == 7.0
+
+
+def test_raise_group_applies_first_matching_rule_only(engine):
+    adjusted, _ = engine.check(scores(3.0), {"LR": "Outstanding range."}, "")
+    assert adjusted["LR"] == 5.5
+
+
+def test_very_positive_comment_lifts_every_low_criterion(engine):
+    adjusted, was_adjusted = engine.check(scores(2.0), {}, "An impressive essay.")
+    assert was_adjusted
+    assert adjusted == scores(5.5)
+
+
+def test_agrees_with_legacy_implementation(engine):
+    for result in make_results(2000, seed=11):
+        assert engine.check(*result) == legacy_validate(*result)
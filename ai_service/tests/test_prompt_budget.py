@@ -0,0 +1,161 @@
+import pytest
+
+from app import prompt_budget
+from app.prompt_budget import PREFIX_TRIM_STEPS, TRIM_ORDER, drop_overlapping_chunks, enforce_budget
+
+real_count_tokens = prompt_budget.count_tokens
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    # One token per word keeps the tests independent of tiktoken's data files
+    calls = []
+
+    def count(text, model):
+        calls.append(text)
+        return len(text.split())
+
+    monkeypatch.setattr(prompt_budget, "count_tokens", count)
+    prompt_budget._static_count.cache_clear()
+    yield calls
+    prompt_budget._static_count.cache_clear()
+
+
+def make_prompt(rubric_chunks, image_words, guidance_words=20):
+    """
+    A prompt with the same shape as process_evaluation's: trimming steps
+    keyed by TRIM_ORDER label that shrink the state render() reads.
+    """
+    state = {"rubric": list(rubric_chunks), "image": image_words, "guidance": guidance_words}
+
+    def render():
+        return {
+            "system": "rules " * 10,
+            "guidance": "g " * state["guidance"],
+            "rubric": " ".join(state["rubric"]),
+            "image": "i " * state["image"],
+            "essay": "e " * 50,
+        }
+
+    def shrink_image(to):
+        def apply():
+            if state["image"] <= to:
+                return False
+            state["image"] = to
+            return True
+        return apply
+
+    def drop_overlap():
+        deduped = drop_overlapping_chunks(state["rubric"])
+        if len(deduped) == len(state["rubric"]):
+            return False
+        state["rubric"] = deduped
+        return True
+
+    def drop_chunk():
+        if len(state["rubric"]) <= 1:
+            return False
+        state["rubric"].pop()
+        return True
+
+    def drop_guidance():
+        if state["guidance"] == 0:
+            return False
+        state["guidance"] = 0
+        return True
+
+    steps = {
+        "image_data_points": shrink_image(60),
+        "image_structured_data": shrink_image(40),
+        "image_description": shrink_image(20),
+        "rubric_overlap": drop_overlap,
+        "rubric_chunk": drop_chunk,
+        "guidance": drop_guidance,
+    }
+    return render, [(label, steps[label]) for label in TRIM_ORDER], state
+
+
+def test_prefix_steps_come_last():
+    assert set(PREFIX_TRIM_STEPS) <= set(TRIM_ORDER)
+    first_prefix = min(TRIM_ORDER.index(step) for step in PREFIX_TRIM_STEPS)
+    assert all(step in PREFIX_TRIM_STEPS for step in TRIM_ORDER[first_prefix:])
+
+
+def test_under_budget_prompt_is_not_trimmed():
+    render, steps, _ = make_prompt(["band seven descriptor"], image_words=10)
+    sections, report = enforce_budget(render, steps, model="test", budget=1000)
+    assert report["trimmed"] == []
+    assert report["total"] == sum(report["sections"].values())
+    assert not report["over_budget"]
+
+
+def test_image_is_trimmed_before_the_cached_prefix():
+    rubric = [f"criterion {n} band descriptor text" for n in range(4)]
+    render, steps, state = make_prompt(rubric, image_words=100)
+    # 10 rules + 20 guidance + 20 rubric + 50 essay = 100; the image must shrink to fit
+    _, report = enforce_budget(render, steps, model="test", budget=150)
+
+    assert report["trimmed"] == ["image_data_points", "image_structured_data"]
+    assert not report["over_budget"]
+    assert state["rubric"] == rubric and state["guidance"] == 20
+
+
+def test_prefix_is_trimmed_only_after_the_image_is_exhausted():
+    rubric = [f"criterion {n} band descriptor text" for n in range(4)]
+    render, steps, state = make_prompt(rubric, image_words=100)
+    _, report = enforce_budget(render, steps, model="test", budget=105)
+
+    assert report["trimmed"] == [
+        "image_data_points",
+        "image_structured_data",
+        "image_description",
+        "rubric_chunk",
+        "rubric_chunk",
+        "rubric_chunk",
+    ]
+    # Overlap removal found nothing to drop; the best chunk is always kept
+    assert state["rubric"] == rubric[:1]
+    assert not report["over_budget"]
+
+
+def test_reports_over_budget_when_nothing_is_left_to_trim():
+    render, steps, state = make_prompt(["only chunk"], image_words=0)
+    _, report = enforce_budget(render, steps, model="test", budget=10)
+    assert report["over_budget"]
+    assert report["trimmed"] == ["guidance"]
+    assert state["rubric"] == ["only chunk"]
+
+
+def test_drop_overlapping_chunks_removes_sliding_window_repeats():
+    first = "Band 7\n- Presents a clear position\n- Ideas are extended"
+    repeat = "- Presents a clear position\n- Ideas are extended\n- Minor lapses"
+    other = "Band 6\n- Addresses all parts of the task"
+    assert drop_overlapping_chunks([first, repeat, other]) == [first, other]
+
+
+def test_unchanged_sections_are_not_recounted(word_tokens):
+    render, steps, _ = make_prompt(["r1 " * 40, "r2 " * 40], image_words=200)
+    _, report = enforce_budget(render, steps, model="m", budget=200)
+    assert report["trimmed"]
+    # The essay never changes while trimming: counted once, not per render
+    assert word_tokens.count("e " * 50) == 1
+
+    # System rules are counted once across requests
+    render, steps, _ = make_prompt(["r1 " * 40], image_words=10)
+    enforce_budget(render, steps, model="m", budget=10_000)
+    assert word_tokens.count("rules " * 10) == 1
+
+
+def test_count_falls_back_to_estimate_without_encoding(monkeypatch):
+    def offline(*args, **kwargs):
+        raise ConnectionError("o200k_base.tiktoken unreachable")
+
+    monkeypatch.setattr(prompt_budget.tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(prompt_budget.tiktoken, "get_encoding", offline)
+    prompt_budget._encoding.cache_clear()
+    try:
+        assert prompt_budget.warm_encoding("m") is False
+        assert real_count_tokens("x" * 10, "m") == 3
+        assert real_count_tokens("", "m") == 0
+    finally:
+        prompt_budget._encoding.cache_clear()
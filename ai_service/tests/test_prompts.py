@@ -0,0 +1,20 @@
+import pytest
+
+from app import prompts
+
+
+@pytest.mark.parametrize("name", ["task_block", "essay_block", "rubric_block", "chart_instruction_block"])
+def test_template_edits_change_the_prompt_hash(monkeypatch, name):
+    original = getattr(prompts, name)
+    monkeypatch.setattr(prompts, name, lambda *args: original(*args) + "edited")
+    assert prompts._prompt_hash() != prompts.PROMPT_HASH
+
+
+def test_layout_edits_change_the_prompt_hash(monkeypatch):
+    original = prompts.assemble_messages
+    monkeypatch.setattr(prompts, "assemble_messages", lambda sections: tuple(reversed(original(sections))))
+    assert prompts._prompt_hash() != prompts.PROMPT_HASH
+
+
+def test_prompt_hash_is_stable():
+    assert prompts._prompt_hash() == prompts.PROMPT_HASH
@@ -0,0 +1,57 @@
+import pytest
+from fastapi import FastAPI, Form, Request
+from fastapi.testclient import TestClient
+
+from app.uploads import RequestSizeLimitMiddleware
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware, limit=1000, path_limits={"/batch": 5000})
+
+    @app.post("/json")
+    async def json_body(request: Request):
+        body = await request.json()
+        return {"size": len(body["text"])}
+
+    @app.post("/form")
+    async def form_body(text: str = Form(...)):
+        return {"size": len(text)}
+
+    @app.post("/batch")
+    async def batch(body: dict):
+        return {"size": len(body["text"])}
+
+    return TestClient(app)
+
+
+def chunks(count, size=100):
+    for _ in range(count):
+        yield b"a" * size
+
+
+def test_small_body_passes(client):
+    assert client.post("/json", json={"text": "a" * 100}).json() == {"size": 100}
+
+
+def test_declared_length_over_limit_is_rejected(client):
+    assert client.post("/json", json={"text": "a" * 2000}).status_code == 413
+    assert client.post("/form", data={"text": "a" * 2000}).status_code == 413
+    assert client.post("/form", files={"text": (None, "a" * 2000)}).status_code == 413
+
+
+def test_chunked_body_is_cut_off(client):
+    # No Content-Length: the limit is enforced while the body is received
+    response = client.post("/json", content=chunks(20), headers={"content-type": "application/json"})
+    assert response.status_code == 413
+    assert "Request too large" in response.json()["detail"]
+
+    form = (b"text=" + part for part in chunks(20))
+    response = client.post("/form", content=form, headers={"content-type": "application/x-www-form-urlencoded"})
+    assert response.status_code == 413
+
+
+def test_path_limit_overrides_default(client):
+    assert client.post("/batch", json={"text": "a" * 3000}).json() == {"size": 3000}
+    assert client.post("/batch", json={"text": "a" * 6000}).status_code == 413
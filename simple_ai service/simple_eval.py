@@ -1,20 +1,42 @@
+"""
+Simple IELTS Writing Task 2 grader.
+
+Grades a single input.txt (default), or bulk-grades a directory of
+===TASK=== / ===ESSAY=== .txt files or a JSONL file of
+{"id": ..., "task": ..., "essay": ...} records with a pool of workers.
+
+Bulk results are appended to a JSONL file as each essay finishes. The output
+file doubles as the checkpoint: ids already present in it are skipped, so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python simple_eval.py
+    python simple_eval.py --input essays/ --output results.jsonl --workers 16
+    python simple_eval.py --input history.jsonl --output results.jsonl
+"""
+
 import os
 import json
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+from typing import Dict, Iterator, Set, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 load_dotenv()
 
 INPUT_FILE = "input.txt"
+MODEL = os.getenv("GRADE_MODEL", "gpt-4o-mini")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def read_input_file(path: str):
-    with open(path, "r", encoding="utf-8") as f:
-        content = f.read()
 
+def parse_task_essay(content: str, source: str = INPUT_FILE):
     if "===TASK===" not in content or "===ESSAY===" not in content:
-        raise ValueError("input.txt must contain ===TASK=== and ===ESSAY===")
+        raise ValueError(f"{source} must contain ===TASK=== and ===ESSAY===")
 
     task = content.split("===TASK===")[1].split("===ESSAY===")[0].strip()
     essay = content.split("===ESSAY===")[1].strip()
@@ -27,7 +49,91 @@ def read_input_file(path: str):
     return task, essay
 
 
-def evaluate(task_prompt: str, essay: str):
+def read_input_file(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    return parse_task_essay(content, path)
+
+
+def iter_items(path: Path) -> Iterator[Tuple[str, str, str]]:
+    """
+    Lazily yield (id, task, essay) from a directory of .txt files or a JSONL file.
+    """
+    if path.is_dir():
+        for file in sorted(path.rglob("*.txt")):
+            try:
+                task, essay = parse_task_essay(file.read_text(encoding="utf-8"), str(file))
+            except ValueError as e:
+                print(f"Skipping {file}: {e}")
+                continue
+            yield str(file.relative_to(path)), task, essay
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                item_id = str(record.get("id", line_no))
+                task = record.get("task") or record.get("task_prompt")
+                essay = record["essay"]
+            except (ValueError, KeyError) as e:
+                print(f"Skipping {path}:{line_no}: {e}")
+                continue
+            if not isinstance(task, str) or not task.strip():
+                print(f"Skipping {path}:{line_no}: no task or task_prompt")
+                continue
+            yield item_id, task, essay
+
+
+def load_checkpoint(output: Path) -> Set[str]:
+    """
+    Ids already graded successfully in a previous (possibly interrupted) run.
+    Failed items are not recorded as done, so they are retried.
+    """
+    done = set()
+    if not output.exists():
+        return done
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # partially written last line of an interrupted run
+            if "result" in record:
+                done.add(record["id"])
+    return done
+
+
+def drop_partial_line(output: Path) -> None:
+    """
+    Cut a partially written last line left by an interrupted run, so the
+    records appended on resume start on a line of their own.
+    """
+    if not output.exists():
+        return
+    with open(output, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos, cut = end, 0
+        while pos > 0:
+            step = min(64 * 1024, pos)
+            pos -= step
+            f.seek(pos)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                cut = pos + newline + 1
+                break
+        if cut < end:
+            print(f"Dropping {end - cut} bytes of a partially written line at the end of {output}")
+            f.truncate(cut)
+
+
+async def evaluate(task_prompt: str, essay: str):
+    """
+    Grade one essay. Returns (result, usage) where usage is the token usage.
+    """
     system_prompt = (
         "You are a strict IELTS Writing Task 2 examiner. "
         "Evaluate using the four criteria: Task Response (TR), "
@@ -50,8 +156,8 @@ Return JSON with:
 - comment (2–4 sentences)
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    response = await client.chat.completions.create(
+        model=MODEL,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
@@ -60,12 +166,95 @@ Return JSON with:
     )
 
     content = response.choices[0].message.content.strip()
-    return json.loads(content)
+    return json.loads(content), response.usage
 
 
-if __name__ == "__main__":
-    task, essay = read_input_file(INPUT_FILE)
-    result = evaluate(task, essay)
+async def grade_bulk(input_path: Path, output: Path, workers: int):
+    drop_partial_line(output)
+    done = load_checkpoint(output)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    latencies = []
+    tokens: Dict[str, int] = {"prompt": 0, "completion": 0}
+    counts = {"ok": 0, "failed": 0, "skipped": 0}
+
+    out = open(output, "a", encoding="utf-8")
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            item_id, task, essay = item
+            start = time.perf_counter()
+            record = {"id": item_id}
+            try:
+                record["result"], usage = await evaluate(task, essay)
+                if usage:
+                    tokens["prompt"] += usage.prompt_tokens
+                    tokens["completion"] += usage.completion_tokens
+                counts["ok"] += 1
+            except Exception as e:
+                record["error"] = str(e)
+                counts["failed"] += 1
+            elapsed = time.perf_counter() - start
+            latencies.append(elapsed)
+            record["latency_s"] = round(elapsed, 3)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+    start = time.perf_counter()
+    pool = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        for item in iter_items(input_path):
+            if item[0] in done:
+                counts["skipped"] += 1
+                continue
+            await queue.put(item)
+        for _ in pool:
+            await queue.put(None)
+        await asyncio.gather(*pool)
+    finally:
+        out.close()
+    elapsed = time.perf_counter() - start
+
+    graded = counts["ok"] + counts["failed"]
+    print("\n=== BULK GRADING SUMMARY ===")
+    print(f"Graded: {counts['ok']}  Failed: {counts['failed']}  Skipped (checkpoint): {counts['skipped']}")
+    print(f"Wall time: {elapsed:.1f}s  Throughput: {graded / elapsed if elapsed else 0:.2f} essays/s")
+    if latencies:
+        latencies.sort()
+
+        def pct(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
 
-    print("\n=== IELTS EVALUATION RESULT ===")
-    print(json.dumps(result, indent=2))
+        print(
+            f"Latency p50: {statistics.median(latencies):.2f}s  "
+            f"p90: {pct(90):.2f}s  p99: {pct(99):.2f}s  max: {latencies[-1]:.2f}s"
+        )
+    print(
+        f"Tokens prompt: {tokens['prompt']}  completion: {tokens['completion']}  "
+        f"total: {tokens['prompt'] + tokens['completion']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=INPUT_FILE, help="input.txt, a directory of .txt files, or a .jsonl file")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL results file (also the resume checkpoint)")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    if input_path.is_file() and input_path.suffix != ".jsonl":
+        task, essay = read_input_file(str(input_path))
+        result, _ = asyncio.run(evaluate(task, essay))
+
+        print("\n=== IELTS EVALUATION RESULT ===")
+        print(json.dumps(result, indent=2))
+        return
+
+    asyncio.run(grade_bulk(input_path, Path(args.output), max(1, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
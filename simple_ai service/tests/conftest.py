@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# simple_eval.py lives next to this directory and builds its client at import
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import simple_eval
+
+ESSAY = "Some people think that cities should invest in public transport. " * 2
+
+
+def write_jsonl(path, ids):
+    with open(path, "w", encoding="utf-8") as f:
+        for item_id in ids:
+            f.write(json.dumps({"id": item_id, "task": "Discuss both views.", "essay": f"{item_id}: {ESSAY}"}) + "\n")
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def fake_grader(fail_ids=(), calls=None):
+    async def evaluate(task, essay):
+        item_id = essay.split(":", 1)[0]
+        if calls is not None:
+            calls.append(item_id)
+        if item_id in fail_ids:
+            raise RuntimeError("model error")
+        return {"overall_band": 6.5}, None
+
+    return evaluate
+
+
+def test_bulk_run_records_results_and_errors(tmp_path, monkeypatch):
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(source, ["a", "b", "c", "d"])
+    monkeypatch.setattr(simple_eval, "evaluate", fake_grader(fail_ids={"c"}))
+
+    asyncio.run(simple_eval.grade_bulk(source, output, workers=3))
+
+    records = {r["id"]: r for r in read_records(output)}
+    assert set(records) == {"a", "b", "c", "d"}
+    assert "error" in records["c"] and "result" not in records["c"]
+    assert simple_eval.load_checkpoint(output) == {"a", "b", "d"}
+
+
+def test_resume_skips_done_and_retries_failed(tmp_path, monkeypatch):
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(source, ["a", "b", "c", "d"])
+    monkeypatch.setattr(simple_eval, "evaluate", fake_grader(fail_ids={"b"}))
+    asyncio.run(simple_eval.grade_bulk(source, output, workers=2))
+
+    calls = []
+    monkeypatch.setattr(simple_eval, "evaluate", fake_grader(calls=calls))
+    asyncio.run(simple_eval.grade_bulk(source, output, workers=2))
+
+    assert calls == ["b"]
+    assert simple_eval.load_checkpoint(output) == {"a", "b", "c", "d"}
+
+
+def test_checkpoint_ignores_truncated_last_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text(
+        json.dumps({"id": "a", "result": {}}) + "\n" + '{"id": "b", "resu',
+        encoding="utf-8",
+    )
+    assert simple_eval.load_checkpoint(output) == {"a"}
+
+
+def test_resume_after_truncated_line_keeps_new_records_intact(tmp_path, monkeypatch):
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_jsonl(source, ["a", "b"])
+    output.write_text(json.dumps({"id": "a", "result": {}}) + "\n" + '{"id": "b", "resu', encoding="utf-8")
+    monkeypatch.setattr(simple_eval, "evaluate", fake_grader())
+
+    asyncio.run(simple_eval.grade_bulk(source, output, workers=1))
+
+    # Every line parses: the partial line was cut, not glued to the new record
+    assert [r["id"] for r in read_records(output)] == ["a", "b"]
+    assert simple_eval.load_checkpoint(output) == {"a", "b"}
+
+
+def test_jsonl_records_without_task_are_skipped(tmp_path):
+    source = tmp_path / "in.jsonl"
+    source.write_text(
+        json.dumps({"id": "a", "essay": ESSAY}) + "\n"
+        + json.dumps({"id": "b", "task_prompt": "Discuss both views.", "essay": ESSAY}) + "\n",
+        encoding="utf-8",
+    )
+    assert [item_id for item_id, _, _ in simple_eval.iter_items(source)] == ["b"]
+
+
+def test_directory_input_uses_relative_paths_as_ids(tmp_path):
+    (tmp_path / "class1").mkdir()
+    (tmp_path / "class1" / "e1.txt").write_text(
+        f"===TASK===\nDiscuss both views.\n===ESSAY===\n{ESSAY}", encoding="utf-8"
+    )
+    (tmp_path / "broken.txt").write_text("no markers here", encoding="utf-8")
+
+    items = list(simple_eval.iter_items(tmp_path))
+
+    assert [item_id for item_id, _, _ in items] == ["class1/e1.txt"]
@@ -0,0 +1,347 @@
+"""
+Audio preprocessing for speaking recordings.
+
+Before a recording is sent to Whisper it is decoded, downmixed to mono,
+resampled to 16 kHz and trimmed of leading/trailing silence, then
+re-encoded compactly. Browser recordings are often stereo 48 kHz with
+seconds of silence at both ends; none of that helps transcription.
+
+Decoding and encoding use ffmpeg when it is on PATH. Without it, WAV input
+is handled in pure Python (wave + NumPy) and other containers are sent
+unchanged, which also means they cannot be split: check_whisper_size turns
+an unsplit file over Whisper's limit into AudioTooLargeError.
+
+Long recordings (a full speaking test runs 11-14 minutes) are split at
+pauses into segments of about TRANSCRIBE_SEGMENT_SECONDS, so they can be
+transcribed in parallel and each request stays far below Whisper's limit.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "1") == "1"
+SAMPLE_RATE = 16000
+# Frames quieter than this (RMS, dBFS) count as silence
+AUDIO_SILENCE_DB = float(os.getenv("AUDIO_SILENCE_DB", "-40"))
+# Audio kept on each side of the detected speech so onsets aren't clipped
+AUDIO_TRIM_PAD_MS = int(os.getenv("AUDIO_TRIM_PAD_MS", "250"))
+FRAME_MS = 20
+# Opus bitrate for the ffmpeg path; speech stays fully intelligible at 24k
+AUDIO_OPUS_BITRATE = os.getenv("AUDIO_OPUS_BITRATE", "24k")
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+# Target segment length for long recordings; recordings shorter than 1.5x
+# this are sent whole. Cuts are placed at the quietest point within
+# SEGMENT_SEARCH_SECONDS of each target boundary.
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "60"))
+SEGMENT_SEARCH_SECONDS = float(os.getenv("SEGMENT_SEARCH_SECONDS", "10"))
+# Silences inside speech shorter than PAUSE_MIN_SECONDS are ordinary gaps
+# between words; from LONG_PAUSE_SECONDS up they count as long pauses.
+# Frames more than PAUSE_DB_BELOW_SPEECH under the speech level are silent,
+# so a noisy room doesn't hide every pause above AUDIO_SILENCE_DB.
+PAUSE_MIN_SECONDS = float(os.getenv("PAUSE_MIN_SECONDS", "0.25"))
+LONG_PAUSE_SECONDS = float(os.getenv("LONG_PAUSE_SECONDS", "1.0"))
+PAUSE_DB_BELOW_SPEECH = float(os.getenv("PAUSE_DB_BELOW_SPEECH", "25"))
+
+
+class AudioTooLargeError(ValueError):
+    """
+    A file that would be sent to Whisper is over WHISPER_MAX_BYTES.
+    """
+
+
+@lru_cache(maxsize=1)
+def ffmpeg_path() -> Optional[str]:
+    return shutil.which("ffmpeg")
+
+
+def _decode_ffmpeg(path: str) -> np.ndarray:
+    proc = subprocess.run(
+        [ffmpeg_path(), "-nostdin", "-v", "error", "-i", path,
+         "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "-"],
+        capture_output=True,
+        check=True,
+    )
+    return np.frombuffer(proc.stdout, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def _decode_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as w:
+        channels = w.getnchannels()
+        width = w.getsampwidth()
+        rate = w.getframerate()
+        raw = w.readframes(w.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE and len(samples):
+        # Linear interpolation is plenty for speech going to an ASR model
+        n_out = int(round(len(samples) * SAMPLE_RATE / rate))
+        samples = np.interp(
+            np.arange(n_out) * (rate / SAMPLE_RATE),
+            np.arange(len(samples)),
+            samples,
+        ).astype(np.float32)
+    return samples
+
+
+def decode_audio(path: str) -> Tuple[Optional[np.ndarray], Optional[str]]:
+    """
+    Decode to mono float32 at SAMPLE_RATE.
+
+    Returns:
+        (samples, decoder) with decoder "ffmpeg" or "wav", or (None, None)
+        when the file can't be decoded here
+    """
+    if ffmpeg_path():
+        try:
+            return _decode_ffmpeg(path), "ffmpeg"
+        except (subprocess.CalledProcessError, OSError):
+            pass
+    try:
+        return _decode_wav(path), "wav"
+    except (wave.Error, EOFError, ValueError, OSError):
+        return None, None
+
+
+def frame_rms_db(samples: np.ndarray, frame_ms: int = FRAME_MS) -> np.ndarray:
+    """
+    RMS level in dBFS of consecutive non-overlapping frames.
+    """
+    frame = SAMPLE_RATE * frame_ms // 1000
+    n = len(samples) // frame
+    if n == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:n * frame].reshape(n, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20.0 * np.log10(np.maximum(rms, 1e-10))
+
+
+def trim_silence(samples: np.ndarray) -> Tuple[np.ndarray, int, int]:
+    """
+    Cut leading and trailing frames below AUDIO_SILENCE_DB, keeping
+    AUDIO_TRIM_PAD_MS of padding. Returns (trimmed, start, end) in samples;
+    all-silent audio is returned unchanged.
+    """
+    voiced = np.flatnonzero(frame_rms_db(samples) > AUDIO_SILENCE_DB)
+    if len(voiced) == 0:
+        return samples, 0, len(samples)
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    pad = SAMPLE_RATE * AUDIO_TRIM_PAD_MS // 1000
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * frame + pad)
+    return samples[start:end], start, end
+
+
+def detect_pauses(samples: np.ndarray) -> Optional[Dict[str, Any]]:
+    """
+    Energy-based pause statistics for (trimmed) speech audio.
+
+    A frame is silent when it is below AUDIO_SILENCE_DB or more than
+    PAUSE_DB_BELOW_SPEECH under the 90th-percentile frame level. Silent runs
+    of at least PAUSE_MIN_SECONDS that don't touch either end are pauses.
+
+    Returns:
+        {"duration_seconds", "phonation_ratio", "pause_count",
+        "long_pause_count", "pause_seconds", "mean_pause_seconds",
+        "pauses_per_minute"}, or None for audio shorter than a frame
+    """
+    db = frame_rms_db(samples)
+    if len(db) == 0:
+        return None
+    threshold = max(AUDIO_SILENCE_DB, float(np.percentile(db, 90)) - PAUSE_DB_BELOW_SPEECH)
+    silent = db < threshold
+    # Run boundaries: +1 where a silent run starts, -1 one past where it ends
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    inner = (starts > 0) & (ends < len(db))
+    lengths = (ends - starts)[inner] * (FRAME_MS / 1000.0)
+    pauses = lengths[lengths >= PAUSE_MIN_SECONDS]
+
+    duration = len(db) * FRAME_MS / 1000.0
+    return {
+        "duration_seconds": round(duration, 2),
+        "phonation_ratio": round(float(1.0 - silent.mean()), 3),
+        "pause_count": int(len(pauses)),
+        "long_pause_count": int(np.count_nonzero(pauses >= LONG_PAUSE_SECONDS)),
+        "pause_seconds": round(float(pauses.sum()), 2),
+        "mean_pause_seconds": round(float(pauses.mean()), 2) if len(pauses) else 0.0,
+        "pauses_per_minute": round(len(pauses) * 60.0 / duration, 1),
+    }
+
+
+def plan_segments(
+    samples: np.ndarray,
+    segment_seconds: float = TRANSCRIBE_SEGMENT_SECONDS,
+    search_seconds: float = SEGMENT_SEARCH_SECONDS,
+) -> List[Tuple[int, int]]:
+    """
+    Split points for long audio, as [(start, end)] sample ranges covering
+    all of samples. Each cut is placed at the lowest 200 ms average level
+    within search_seconds of the target boundary, i.e. in a pause rather
+    than mid-word.
+    """
+    n = len(samples)
+    seg = int(segment_seconds * SAMPLE_RATE)
+    if seg <= 0 or n <= seg * 1.5:
+        return [(0, n)]
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    search = int(min(search_seconds, segment_seconds / 3) * SAMPLE_RATE)
+    smooth = max(1, 200 // FRAME_MS)
+    db = frame_rms_db(samples)
+
+    bounds = [0]
+    while n - bounds[-1] > seg * 1.5:
+        target = bounds[-1] + seg
+        lo = (target - search) // frame
+        hi = (target + search) // frame
+        window = np.convolve(db[lo:hi], np.ones(smooth) / smooth, mode="same")
+        bounds.append((lo + int(np.argmin(window))) * frame)
+    bounds.append(n)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _pcm16(samples: np.ndarray) -> bytes:
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+def encode_wav(samples: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(_pcm16(samples))
+    return buf.getvalue()
+
+
+def _encode_opus(samples: np.ndarray) -> bytes:
+    proc = subprocess.run(
+        [ffmpeg_path(), "-nostdin", "-v", "error",
+         "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "-",
+         "-c:a", "libopus", "-b:a", AUDIO_OPUS_BITRATE, "-application", "voip", "-f", "ogg", "-"],
+        input=_pcm16(samples),
+        capture_output=True,
+        check=True,
+    )
+    return proc.stdout
+
+
+def encode_audio(samples: np.ndarray) -> Tuple[bytes, str]:
+    """
+    Encode mono 16 kHz samples compactly: Ogg/Opus with ffmpeg, else WAV.
+    Returns (data, file suffix).
+    """
+    if ffmpeg_path():
+        try:
+            return _encode_opus(samples), ".ogg"
+        except (subprocess.CalledProcessError, OSError):
+            pass
+    return encode_wav(samples), ".wav"
+
+
+def _write_temp(data: bytes, suffix: str) -> str:
+    fd, out_path = tempfile.mkstemp(prefix="speaking_prep_", suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return out_path
+
+
+def preprocess_audio(path: str) -> Tuple[List[Tuple[str, float]], Dict[str, Any]]:
+    """
+    Decode, downmix/resample, trim silence, split long recordings and
+    re-encode.
+
+    A short recording is re-encoded whole; the processed file is used when
+    it is smaller than the original or removed at least a second of silence
+    (Whisper time is what costs), otherwise the original path is used.
+    Long recordings are always split (see plan_segments).
+
+    Returns:
+        ([(path, offset seconds in the original recording)], report).
+        Paths other than the input are new temp files the caller must delete.
+    """
+    started = time.perf_counter()
+    original_bytes = os.path.getsize(path)
+    report: Dict[str, Any] = {
+        "applied": False,
+        "original_bytes": original_bytes,
+        "bytes": original_bytes,
+        "segments": 1,
+    }
+
+    samples, decoder = decode_audio(path)
+    if samples is None:
+        report["reason"] = "no decoder for this format (install ffmpeg)"
+        return [(path, 0.0)], report
+
+    trimmed, start, end = trim_silence(samples)
+    seconds_removed = (len(samples) - len(trimmed)) / SAMPLE_RATE
+    report.update({
+        "decoder": decoder,
+        "original_seconds": round(len(samples) / SAMPLE_RATE, 2),
+        "seconds": round(len(trimmed) / SAMPLE_RATE, 2),
+        "seconds_removed": round(seconds_removed, 2),
+        "leading_silence_seconds": round(start / SAMPLE_RATE, 2),
+        "trailing_silence_seconds": round((len(samples) - end) / SAMPLE_RATE, 2),
+    })
+
+    # Measured here because this is the only place the waveform is decoded;
+    # the caller moves it out of the report (see app/fluency.py)
+    report["waveform"] = detect_pauses(trimmed)
+
+    ranges = plan_segments(trimmed)
+    encoded = [(encode_audio(trimmed[a:b]), (start + a) / SAMPLE_RATE) for a, b in ranges]
+    total = sum(len(data) for (data, _), _ in encoded)
+    report["ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    if len(encoded) == 1 and total >= original_bytes and (seconds_removed < 1.0 or total > WHISPER_MAX_BYTES):
+        report["reason"] = "original is already compact"
+        return [(path, 0.0)], report
+
+    segments = [(_write_temp(data, suffix), offset) for (data, suffix), offset in encoded]
+    report.update({
+        "applied": True,
+        "format": encoded[0][0][1].lstrip("."),
+        "bytes": total,
+        "bytes_removed": original_bytes - total,
+        "segments": len(segments),
+    })
+    return segments, report
+
+
+def check_whisper_size(parts: List[Tuple[str, float]], report: Dict[str, Any]) -> None:
+    """
+    Raise AudioTooLargeError when a part from preprocess_audio is still over
+    WHISPER_MAX_BYTES, i.e. the recording could not be decoded and split.
+    """
+    mb = 1024 * 1024
+    for part_path, _ in parts:
+        size = os.path.getsize(part_path)
+        if size > WHISPER_MAX_BYTES:
+            reason = report.get("reason")
+            raise AudioTooLargeError(
+                f"Recording is {size / mb:.0f} MB and could not be split for transcription"
+                + (f" ({reason})" if reason else "")
+                + f"; Whisper accepts at most {WHISPER_MAX_BYTES / mb:.0f} MB per request. "
+                "Install ffmpeg on the server, or upload WAV or a shorter recording."
+            )
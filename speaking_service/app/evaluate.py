@@ -5,20 +5,49 @@ Evaluates IELTS speaking recordings using OpenAI Audio API
 
 import os
 import json
-from typing import Dict, Any
-from openai import OpenAI
+import asyncio
+import time
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize OpenAI client
+from app.audio import AUDIO_PREPROCESS, check_whisper_size, preprocess_audio
+from app.fluency import fluency_features, fluency_prompt_block
+from app.openai_client import get_async_client
+from app.transcript_cache import (
+    TRANSCRIBE_LANGUAGE,
+    TRANSCRIBE_MODEL,
+    file_sha256,
+    transcript_store,
+)
+
+# The shared client (app.openai_client) reads the key from the environment
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise RuntimeError("Missing OPENAI_API_KEY in .env")
 
-client = OpenAI(api_key=api_key)
+# Maximum number of recordings evaluated at the same time in this process.
+# Extra requests wait for a free slot instead of piling onto the OpenAI API.
+SPEAKING_MAX_CONCURRENCY = int(os.getenv("SPEAKING_MAX_CONCURRENCY", "4"))
+_evaluation_slots = asyncio.Semaphore(SPEAKING_MAX_CONCURRENCY)
+
+# Whisper requests in flight per process. Long recordings are split into
+# segments that are transcribed in parallel within this cap.
+TRANSCRIBE_MAX_CONCURRENCY = int(os.getenv("TRANSCRIBE_MAX_CONCURRENCY", "8"))
+_transcription_slots = asyncio.Semaphore(TRANSCRIBE_MAX_CONCURRENCY)
+
+
+def transcription_timestamps(model: str) -> bool:
+    """
+    Whether model returns verbose_json with segment and word timestamps.
+    Only whisper-1 does; the gpt-4o transcribe models answer plain json
+    (text only), so segments and fluency.words are unavailable with them.
+    """
+    return model.startswith("whisper")
+
 
 # Load grading criteria
 def load_grading_criteria() -> str:
@@ -28,32 +57,221 @@ def load_grading_criteria() -> str:
         return f.read()
 
 
-def transcribe_audio(audio_path: str) -> str:
+async def prepare_audio(audio_path: str) -> Tuple[List[Tuple[str, float]], Dict[str, Any]]:
+    """
+    Preprocessing stage before Whisper: decode, downmix to mono 16 kHz,
+    trim leading/trailing silence, split long recordings at pauses and
+    re-encode (see app/audio.py). Runs in a worker thread.
+    
+    Args:
+        audio_path: Path to the audio file
+        
+    Returns:
+        ([(path to transcribe, offset seconds)], report with bytes and
+        seconds removed). Paths other than audio_path are deleted by the caller.
+    """
+    if not AUDIO_PREPROCESS:
+        return [(audio_path, 0.0)], {"applied": False, "reason": "disabled", "segments": 1}
+    try:
+        return await asyncio.to_thread(preprocess_audio, audio_path)
+    except Exception as e:
+        # Never fail an evaluation because of preprocessing
+        print(f"WARNING: audio preprocessing failed: {e}")
+        return [(audio_path, 0.0)], {"applied": False, "reason": str(e), "segments": 1}
+
+
+async def transcribe_audio(
+    audio_path: str,
+    offset: float = 0.0,
+) -> Tuple[str, List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
     Transcribe audio file using OpenAI Whisper API
     
     Args:
         audio_path: Path to the audio file
+        offset: Where this file starts in the full recording, in seconds
+        
+    Returns:
+        (transcribed text, [{"start", "end", "text"}] segments,
+        [{"word", "start", "end"}] words), timestamps shifted by offset;
+        segments and words are empty when the model has no timestamps
+    """
+    if transcription_timestamps(TRANSCRIBE_MODEL):
+        timing = {"response_format": "verbose_json", "timestamp_granularities": ["word", "segment"]}
+    else:
+        timing = {"response_format": "json"}
+    async with _transcription_slots:
+        # Pass an open file so the request body is streamed from disk
+        audio_file = await asyncio.to_thread(open, audio_path, "rb")
+        try:
+            transcript = await get_async_client().audio.transcriptions.create(
+                model=TRANSCRIBE_MODEL,
+                file=(Path(audio_path).name, audio_file),
+                language=TRANSCRIBE_LANGUAGE,
+                **timing,
+            )
+        finally:
+            audio_file.close()
+    segments = [
+        {
+            "start": round(seg.start + offset, 2),
+            "end": round(seg.end + offset, 2),
+            "text": seg.text.strip(),
+        }
+        for seg in (getattr(transcript, "segments", None) or [])
+    ]
+    words = [
+        {"word": w.word, "start": round(w.start + offset, 2), "end": round(w.end + offset, 2)}
+        for w in (getattr(transcript, "words", None) or [])
+    ]
+    return transcript.text.strip(), segments, words
+
+
+async def transcribe_segments(
+    parts: List[Tuple[str, float]],
+) -> Tuple[str, List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Transcribe the parts of a split recording concurrently (bounded by
+    TRANSCRIBE_MAX_CONCURRENCY) and stitch them back together in order.
+    
+    Args:
+        parts: [(path, offset seconds in the full recording)]
+        
+    Returns:
+        (full transcript, segments, words), on the full recording's timeline
+    """
+    results = await asyncio.gather(*(transcribe_audio(path, offset) for path, offset in parts))
+    text = " ".join(part_text for part_text, _, _ in results if part_text)
+    segments = [seg for _, part_segments, _ in results for seg in part_segments]
+    words = [word for _, _, part_words in results for word in part_words]
+    return text, segments, words
+
+
+async def evaluate_speaking(
+    audio_path: str,
+    task_prompt: str,
+    audio_sha256: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Evaluate speaking performance, waiting for a free slot first.
+    
+    At most SPEAKING_MAX_CONCURRENCY evaluations run at once per process.
+    
+    Args:
+        audio_path: Path to the audio file
+        task_prompt: The IELTS speaking task prompt (cue card)
+        audio_sha256: SHA-256 of the audio if already known (hashed otherwise)
         
     Returns:
-        Transcribed text
+        Dictionary with evaluation results
     """
-    with open(audio_path, 'rb') as audio_file:
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            language="en"
-        )
-    return transcript.text
+    async with _evaluation_slots:
+        return await _evaluate_speaking(audio_path, task_prompt, audio_sha256)
+
+
+async def evaluate_transcript(
+    task_prompt: str,
+    transcript: Optional[str] = None,
+    audio_sha256: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Re-grade without the audio: from transcript text, or from the stored
+    transcript (and fluency measurements) of a previously evaluated
+    recording.
+    
+    Args:
+        task_prompt: The IELTS speaking task prompt (cue card)
+        transcript: Transcript text to grade
+        audio_sha256: SHA-256 of a recording whose transcript is stored
+        
+    Returns:
+        Dictionary with evaluation results
+
+    Raises:
+        LookupError: no stored transcript for audio_sha256
+    """
+    fluency = None
+    if transcript is None:
+        cached = await transcript_store.aget(audio_sha256 or "")
+        if cached is None:
+            raise LookupError(f"No stored transcript for audio {audio_sha256}")
+        transcript = cached["text"]
+        fluency = cached.get("fluency")
+    async with _evaluation_slots:
+        result = await grade_transcript(transcript, task_prompt, fluency)
+    result["fluency"] = fluency
+    if audio_sha256:
+        result["audio_sha256"] = audio_sha256
+    return result
 
 
-def evaluate_speaking(audio_path: str, task_prompt: str) -> Dict[str, Any]:
+async def _evaluate_speaking(
+    audio_path: str,
+    task_prompt: str,
+    audio_sha256: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Evaluate speaking performance using OpenAI GPT-4
+    Transcribe (or reuse the stored transcript), then grade.
     
     Args:
         audio_path: Path to the audio file
         task_prompt: The IELTS speaking task prompt (cue card)
+        audio_sha256: SHA-256 of the audio if already known
+        
+    Returns:
+        Dictionary with evaluation results
+
+    Raises:
+        AudioTooLargeError: over Whisper's limit and could not be split
+            (raised before any Whisper call)
+    """
+    if audio_sha256 is None:
+        audio_sha256 = await asyncio.to_thread(file_sha256, audio_path)
+
+    cached = await transcript_store.aget(audio_sha256)
+    if cached is not None:
+        # Same recording seen before: skip preprocessing and the Whisper upload
+        transcript = cached["text"]
+        transcript_segments = cached.get("segments") or []
+        fluency = cached.get("fluency")
+        audio_report = {"applied": False, "reason": "transcript cache hit"}
+    else:
+        # Preprocess (and split long recordings), then transcribe audio
+        parts, audio_report = await prepare_audio(audio_path)
+        started = time.perf_counter()
+        try:
+            check_whisper_size(parts, audio_report)
+            transcript, transcript_segments, words = await transcribe_segments(parts)
+        finally:
+            for part_path, _ in parts:
+                if part_path != audio_path:
+                    Path(part_path).unlink(missing_ok=True)
+        audio_report["transcription_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        fluency = fluency_features(words, audio_report.pop("waveform", None))
+        print(f"Audio preprocessing: {audio_report}")
+        await transcript_store.aset(audio_sha256, transcript, transcript_segments, fluency)
+
+    result = await grade_transcript(transcript, task_prompt, fluency)
+    result["transcript_segments"] = transcript_segments
+    result["fluency"] = fluency
+    result["audio_preprocessing"] = audio_report
+    result["audio_sha256"] = audio_sha256
+    result["transcript_cache_hit"] = cached is not None
+    return result
+
+
+async def grade_transcript(
+    transcript: str,
+    task_prompt: str,
+    fluency: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Evaluate speaking performance from its transcript using OpenAI GPT-4
+    
+    Args:
+        transcript: Transcribed speech
+        task_prompt: The IELTS speaking task prompt (cue card)
+        fluency: Timing measurements from app.fluency, if available
         
     Returns:
         Dictionary with evaluation results
@@ -61,9 +279,6 @@ def evaluate_speaking(audio_path: str, task_prompt: str) -> Dict[str, Any]:
     # Load grading criteria
     grading_criteria = load_grading_criteria()
     
-    # Transcribe audio
-    transcript = transcribe_audio(audio_path)
-    
     # Prepare system prompt with grading criteria
     system_prompt = f"""You are an expert IELTS speaking examiner. Evaluate the candidate's speaking performance based on the IELTS Speaking Band Descriptors.
 
@@ -109,13 +324,18 @@ Return your response as a valid JSON object with this exact structure:
 
 IMPORTANT: Return ONLY valid JSON, no additional text or markdown formatting."""
 
+    # Timing measurements, when the recording was available
+    timing_block = fluency_prompt_block(fluency)
+    if timing_block:
+        timing_block = f"\n{timing_block}\n"
+
     # Prepare user message
     user_message = f"""TASK PROMPT (Cue Card):
 {task_prompt}
 
 TRANSCRIBED SPEECH:
 {transcript}
-
+{timing_block}
 Please evaluate this speaking performance according to the IELTS Speaking Band Descriptors. Consider:
 - How well the candidate addressed the task prompt
 - Fluency and coherence of speech
@@ -126,7 +346,7 @@ Please evaluate this speaking performance according to the IELTS Speaking Band D
 Return your evaluation as a JSON object with the structure specified above."""
 
     # Call GPT-4 for evaluation
-    response = client.chat.completions.create(
+    response = await get_async_client().chat.completions.create(
         model="gpt-4o",  # Using GPT-4o for better analysis
         messages=[
             {"role": "system", "content": system_prompt},
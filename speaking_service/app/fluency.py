@@ -0,0 +1,116 @@
+"""
+Fluency and pause measurements for speaking recordings.
+
+Computed locally from the word timestamps Whisper already returns and the
+energy-based pause detection in app/audio.py, so the grader judges Fluency
+and Pronunciation with timing data rather than text alone. Everything here
+is a few vectorised NumPy passes over at most a few thousand words.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.audio import LONG_PAUSE_SECONDS, PAUSE_MIN_SECONDS
+
+# Hesitation tokens as Whisper spells them. Whisper tends to drop fillers,
+# so filled_pause_ratio is a lower bound.
+FILLERS = ("um", "umm", "uh", "uhm", "er", "erm", "ah", "eh", "hmm", "mm")
+
+_WORD_STRIP_RE = re.compile(r"[^\w']+")
+
+
+def word_features(words: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Rate and pause features from word timestamps ([{"word", "start", "end"}]
+    on the recording's timeline).
+
+    Speech rate counts the whole span from the first word to the last;
+    articulation rate leaves out the pauses (gaps of at least
+    PAUSE_MIN_SECONDS between consecutive words).
+
+    Returns:
+        Feature dict, or None when there are fewer than two words
+    """
+    if len(words) < 2:
+        return None
+    starts = np.fromiter((w["start"] for w in words), dtype=np.float64, count=len(words))
+    ends = np.fromiter((w["end"] for w in words), dtype=np.float64, count=len(words))
+    tokens = np.array([_WORD_STRIP_RE.sub("", w["word"]).lower() for w in words])
+
+    span = float(ends[-1] - starts[0])
+    if span <= 0:
+        return None
+    gaps = np.maximum(starts[1:] - ends[:-1], 0.0)
+    is_pause = gaps >= PAUSE_MIN_SECONDS
+    pauses = gaps[is_pause]
+    speaking_time = max(span - float(pauses.sum()), 1e-6)
+    filled = int(np.count_nonzero(np.isin(tokens, FILLERS)))
+
+    return {
+        "word_count": len(words),
+        "speaking_seconds": round(span, 2),
+        "speech_rate_wpm": round(len(words) * 60.0 / span, 1),
+        "articulation_rate_wpm": round(len(words) * 60.0 / speaking_time, 1),
+        "pause_count": int(len(pauses)),
+        "long_pause_count": int(np.count_nonzero(pauses >= LONG_PAUSE_SECONDS)),
+        "mean_pause_seconds": round(float(pauses.mean()), 2) if len(pauses) else 0.0,
+        "pauses_per_minute": round(len(pauses) * 60.0 / span, 1),
+        # Words between pauses
+        "mean_run_words": round(len(words) / (len(pauses) + 1), 1),
+        "filled_pauses": filled,
+        "filled_pause_ratio": round(filled / len(words), 3),
+    }
+
+
+def fluency_features(
+    words: List[Dict[str, Any]],
+    waveform: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Combine word-timestamp features with the waveform pause statistics
+    (app.audio.detect_pauses). Either part may be missing.
+
+    Returns:
+        {"words": {...} or None, "waveform": {...} or None}, or None when
+        neither is available
+    """
+    from_words = word_features(words)
+    if from_words is None and waveform is None:
+        return None
+    return {"words": from_words, "waveform": waveform}
+
+
+def fluency_prompt_block(features: Optional[Dict[str, Any]]) -> str:
+    """
+    The measurements as prompt text for the grader; empty without features.
+    """
+    if not features:
+        return ""
+    lines = []
+    w = features.get("words")
+    if w:
+        lines += [
+            f"- Speech rate: {w['speech_rate_wpm']} words/min over {w['speaking_seconds']} s "
+            f"(articulation rate excluding pauses: {w['articulation_rate_wpm']} words/min)",
+            f"- Pauses between words (>= {PAUSE_MIN_SECONDS:g} s): {w['pause_count']} "
+            f"({w['pauses_per_minute']}/min, mean {w['mean_pause_seconds']} s), "
+            f"{w['long_pause_count']} of them >= {LONG_PAUSE_SECONDS:g} s",
+            f"- Mean words between pauses: {w['mean_run_words']}",
+            f"- Filled pauses (um, uh, er...) in transcript: {w['filled_pauses']} "
+            f"({w['filled_pause_ratio'] * 100:.1f}% of words; transcription often omits them)",
+        ]
+    a = features.get("waveform")
+    if a:
+        lines += [
+            f"- Audio: {a['duration_seconds']} s, voiced {a['phonation_ratio'] * 100:.0f}% of the time, "
+            f"{a['pause_count']} silent pauses ({a['long_pause_count']} long, "
+            f"{a['pause_seconds']} s in total)",
+        ]
+    return (
+        "TIMING MEASUREMENTS (measured automatically from the recording):\n"
+        + "\n".join(lines)
+        + "\n\nUse these as evidence for Fluency and Coherence (hesitation, pace, "
+        "length of fluent runs) and, where relevant, Pronunciation (rhythm, chunking)."
+    )
@@ -3,22 +3,34 @@ FastAPI Application for IELTS Speaking Evaluation Service
 """
 
 import os
-from pathlib import Path
+from contextlib import asynccontextmanager
 from typing import Optional
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
-from app.evaluate import evaluate_speaking
+from app.audio import AudioTooLargeError
+from app.evaluate import evaluate_speaking, evaluate_transcript
+from app.openai_client import close_async_client
+from app.uploads import MAX_REQUEST_BYTES, RequestSizeLimitMiddleware, save_upload
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_async_client()
+
+
 # Initialize FastAPI app
-app = FastAPI(title="IELTS Speaking Evaluation Service")
+app = FastAPI(title="IELTS Speaking Evaluation Service", lifespan=lifespan)
+
+# Reject oversized uploads before the multipart body is spooled
+app.add_middleware(RequestSizeLimitMiddleware, limit=MAX_REQUEST_BYTES)
 
-# Add CORS middleware
+# Add CORS middleware (added last so it wraps the 413 responses too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, specify allowed origins
@@ -63,16 +75,12 @@ async def evaluate(
             if not os.path.exists(audio_path):
                 raise HTTPException(status_code=400, detail=f"Audio file not found: {audio_path}")
             temp_audio_path = audio_path
+            audio_sha256 = None  # hashed by evaluate_speaking
             cleanup_file = False
         elif audio:
-            # Save uploaded file temporarily
-            upload_dir = Path("/tmp/speaking_uploads")
-            upload_dir.mkdir(exist_ok=True)
-            
-            temp_audio_path = upload_dir / f"temp_{audio.filename}"
-            with open(temp_audio_path, "wb") as f:
-                content = await audio.read()
-                f.write(content)
+            # Stream the upload to a uniquely named temp file (never fully in memory)
+            temp_audio_path, audio_sha256, audio_size = await save_upload(audio)
+            print(f"Saved upload {audio.filename!r}: {audio_size} bytes, sha256 {audio_sha256[:12]}")
             cleanup_file = True
         else:
             raise HTTPException(status_code=400, detail="Either audio_path or audio file must be provided")
@@ -83,7 +91,7 @@ async def evaluate(
                 raise HTTPException(status_code=400, detail="Task prompt is required")
             
             # Evaluate speaking
-            result = evaluate_speaking(str(temp_audio_path), task_prompt)
+            result = await evaluate_speaking(str(temp_audio_path), task_prompt, audio_sha256)
             
             return JSONResponse(content={
                 "ok": True,
@@ -100,6 +108,8 @@ async def evaluate(
                     
     except HTTPException:
         raise
+    except AudioTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         import traceback
         error_detail = str(e)
@@ -110,6 +120,45 @@ async def evaluate(
         )
 
 
+@app.post("/evaluate-transcript")
+async def evaluate_from_transcript(
+    task_prompt: str = Form(...),
+    audio_sha256: Optional[str] = Form(None),
+    transcript: Optional[str] = Form(None)
+):
+    """
+    Re-grade a speaking submission without its audio
+    
+    Args:
+        task_prompt: The IELTS speaking task prompt (cue card)
+        audio_sha256: audio_sha256 from an earlier /evaluate result; its
+            stored transcript is graded
+        transcript: Transcript text to grade (instead of audio_sha256)
+        
+    Returns:
+        JSON with evaluation results
+    """
+    if not task_prompt.strip():
+        raise HTTPException(status_code=400, detail="Task prompt is required")
+    if not audio_sha256 and not (transcript and transcript.strip()):
+        raise HTTPException(status_code=400, detail="Either audio_sha256 or transcript must be provided")
+    try:
+        result = await evaluate_transcript(task_prompt, transcript=transcript, audio_sha256=audio_sha256)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error evaluating speaking: {str(e)}"
+        )
+    return JSONResponse(content={
+        "ok": True,
+        "result": result
+    })
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
@@ -0,0 +1,56 @@
+"""
+Shared OpenAI client for the speaking service.
+
+Transcription and grading calls go through one AsyncOpenAI client backed by a
+single pooled httpx transport, so several recordings can be processed at once
+without blocking the event loop or opening a new connection per call.
+"""
+
+import os
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "50"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "180"))
+
+_client: Optional[AsyncOpenAI] = None
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Return the process-wide AsyncOpenAI client, creating it on first use.
+
+    Call this where the client is used rather than keeping the result:
+    close_async_client() closes it at shutdown, and the next call after a
+    restart of the app lifespan builds a fresh one.
+    """
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10.0),
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client,
+        )
+    return _client
+
+
+async def close_async_client() -> None:
+    """
+    Close the shared client and its connection pool (called on app shutdown).
+    """
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,110 @@
+"""
+Persistent transcript store for the speaking service.
+
+Transcription is the slowest step of an evaluation, and retries, prompt
+changes and regrades all re-send the same recording. Transcripts are stored
+as JSON files under TRANSCRIPT_CACHE_DIR, keyed by the SHA-256 of the audio
+bytes plus the transcription model and language, so a recording is sent to
+Whisper once and can later be regraded from its transcript alone.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRANSCRIPT_CACHE_DIR = os.getenv("TRANSCRIPT_CACHE_DIR", "./transcript_cache")
+TRANSCRIBE_MODEL = os.getenv("TRANSCRIBE_MODEL", "whisper-1")
+TRANSCRIBE_LANGUAGE = os.getenv("TRANSCRIBE_LANGUAGE", "en")
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a file, read in chunks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def transcript_key(audio_sha256: str, model: str = TRANSCRIBE_MODEL, language: str = TRANSCRIBE_LANGUAGE) -> str:
+    return hashlib.sha256(f"{audio_sha256}\x00{model}\x00{language}".encode("utf-8")).hexdigest()
+
+
+class TranscriptStore:
+    """
+    One JSON file per transcript, written atomically. Safe to share
+    between worker processes.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, audio_sha256: str, model: str = TRANSCRIBE_MODEL, language: str = TRANSCRIBE_LANGUAGE) -> Optional[Dict[str, Any]]:
+        """
+        The stored record ({"text", "segments", "fluency", "audio_sha256",
+        "model", "language", "created_at"}) or None.
+        """
+        try:
+            with open(self._path(transcript_key(audio_sha256, model, language)), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(
+        self,
+        audio_sha256: str,
+        text: str,
+        segments: Optional[List[Dict[str, Any]]] = None,
+        fluency: Optional[Dict[str, Any]] = None,
+        model: str = TRANSCRIBE_MODEL,
+        language: str = TRANSCRIBE_LANGUAGE,
+    ) -> None:
+        record = {
+            "text": text,
+            "segments": segments or [],
+            "fluency": fluency,
+            "audio_sha256": audio_sha256,
+            "model": model,
+            "language": language,
+            "created_at": time.time(),
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp, self._path(transcript_key(audio_sha256, model, language)))
+        except OSError:
+            Path(tmp).unlink(missing_ok=True)
+
+    async def aget(self, audio_sha256: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, audio_sha256)
+
+    async def aset(
+        self,
+        audio_sha256: str,
+        text: str,
+        segments: Optional[List[Dict[str, Any]]] = None,
+        fluency: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        await asyncio.to_thread(self.set, audio_sha256, text, segments, fluency)
+
+
+transcript_store = TranscriptStore(TRANSCRIPT_CACHE_DIR)
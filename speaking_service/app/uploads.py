@@ -0,0 +1,123 @@
+"""
+Streaming storage for uploaded speaking recordings.
+
+Uploads are copied in fixed-size chunks into a uniquely named file under
+SPEAKING_UPLOAD_DIR, hashed while they are written and capped at
+MAX_AUDIO_UPLOAD_BYTES, so a request never holds the whole recording in
+memory and two uploads with the same filename never share a path.
+
+That cap applies while the file is copied, after Starlette has already
+spooled the multipart body. RequestSizeLimitMiddleware caps the request
+itself: a declared Content-Length over MAX_REQUEST_BYTES is rejected before
+the body is read, and a chunked body is cut off once it passes the limit.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+load_dotenv()
+
+UPLOAD_DIR = Path(os.getenv("SPEAKING_UPLOAD_DIR", "/tmp/speaking_uploads"))
+# Recordings are trimmed and split before Whisper (app/audio.py), so this is
+# independent of Whisper's 25 MB per-request limit. A 14-minute stereo
+# 48 kHz WAV is about 160 MB.
+MAX_AUDIO_UPLOAD_BYTES = int(os.getenv("MAX_AUDIO_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+# Whole request body: the recording plus the multipart framing and form fields
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(MAX_AUDIO_UPLOAD_BYTES + 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+_SUFFIX_RE = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+
+def _safe_suffix(filename: str) -> str:
+    # Whisper detects the container from the extension; keep it if it looks sane
+    suffix = Path(filename or "").suffix.lower()
+    return suffix if _SUFFIX_RE.match(suffix) else ".webm"
+
+
+async def save_upload(upload: UploadFile, limit: int = MAX_AUDIO_UPLOAD_BYTES) -> Tuple[Path, str, int]:
+    """
+    Stream an upload to a new temporary file.
+
+    Returns:
+        (path, sha256 hex digest, size in bytes). The caller deletes the file.
+    """
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(prefix="upload_", suffix=_safe_suffix(upload.filename), dir=UPLOAD_DIR)
+    path = Path(name)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"Audio file too large (limit {limit / (1024 * 1024):.0f} MB)",
+                    )
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path, digest.hexdigest(), size
+
+
+def _request_too_large(limit: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Request too large (limit {limit / (1024 * 1024):.0f} MB)",
+    )
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware that caps the request body before any handler parses it.
+
+    limit applies to every path except those listed in path_limits.
+    """
+
+    def __init__(self, app, limit: int = MAX_REQUEST_BYTES, path_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.limit = limit
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.limit)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            error = _request_too_large(limit)
+            response = JSONResponse({"detail": error.detail}, status_code=error.status_code)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def capped_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the form parser's read, so FastAPI turns it into a 413
+                    raise _request_too_large(limit)
+            return message
+
+        await self.app(scope, capped_receive, send)
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from app import audio
+from app.audio import (
+    SAMPLE_RATE,
+    AudioTooLargeError,
+    check_whisper_size,
+    decode_audio,
+    detect_pauses,
+    encode_wav,
+    plan_segments,
+    preprocess_audio,
+    trim_silence,
+)
+
+BURST_SECONDS = 3.0
+PAUSE_SECONDS = 0.5
+
+
+@pytest.fixture(autouse=True)
+def no_ffmpeg(monkeypatch):
+    # The pure-Python WAV path behaves the same on every machine
+    monkeypatch.setattr(audio, "ffmpeg_path", lambda: None)
+
+
+def seconds(value):
+    return int(value * SAMPLE_RATE)
+
+
+def speech(duration, rng):
+    return rng.uniform(-0.3, 0.3, seconds(duration)).astype(np.float32)
+
+
+def silence(duration):
+    return np.zeros(seconds(duration), dtype=np.float32)
+
+
+def talk(total_seconds, lead=0.0, tail=0.0, seed=0):
+    """
+    Noise bursts of BURST_SECONDS separated by PAUSE_SECONDS of silence.
+    """
+    rng = np.random.default_rng(seed)
+    parts = [silence(lead)]
+    elapsed = 0.0
+    while elapsed < total_seconds:
+        parts += [speech(BURST_SECONDS, rng), silence(PAUSE_SECONDS)]
+        elapsed += BURST_SECONDS + PAUSE_SECONDS
+    parts.append(silence(tail))
+    return np.concatenate(parts)
+
+
+def in_pause(sample, lead=0.0):
+    t = (sample / SAMPLE_RATE - lead) % (BURST_SECONDS + PAUSE_SECONDS)
+    return BURST_SECONDS <= t <= BURST_SECONDS + PAUSE_SECONDS
+
+
+def test_short_audio_is_one_segment():
+    samples = talk(60)
+    assert plan_segments(samples) == [(0, len(samples))]
+
+
+def test_cuts_fall_inside_pauses():
+    samples = talk(200)
+    ranges = plan_segments(samples, segment_seconds=60, search_seconds=10)
+    assert len(ranges) > 2
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(samples)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert in_pause(start)
+    for start, end in ranges[:-1]:
+        assert 50 <= (end - start) / SAMPLE_RATE <= 70
+    assert (ranges[-1][1] - ranges[-1][0]) / SAMPLE_RATE <= 90
+
+
+def test_trim_silence_keeps_padding():
+    samples = np.concatenate([silence(1.0), talk(10), silence(2.0)])
+    trimmed, start, end = trim_silence(samples)
+    pad = SAMPLE_RATE * audio.AUDIO_TRIM_PAD_MS // 1000
+    assert start == seconds(1.0) - pad
+    # talk() ends on a pause, so the last voiced frame is before it
+    assert end == len(samples) - seconds(2.0 + PAUSE_SECONDS) + pad
+    assert np.array_equal(trimmed, samples[start:end])
+
+
+def test_trim_silence_leaves_silent_audio_alone():
+    samples = silence(2.0)
+    trimmed, start, end = trim_silence(samples)
+    assert (start, end) == (0, len(samples)) and len(trimmed) == len(samples)
+
+
+def test_detect_pauses_counts_inner_pauses():
+    rng = np.random.default_rng(1)
+    samples = np.concatenate([
+        speech(2.0, rng), silence(0.5),
+        speech(2.0, rng), silence(1.5),
+        speech(2.0, rng), silence(0.1),  # a gap between words, not a pause
+        speech(2.0, rng),
+    ])
+    stats = detect_pauses(samples)
+    assert stats["pause_count"] == 2
+    assert stats["long_pause_count"] == 1
+    assert stats["pause_seconds"] == pytest.approx(2.0, abs=0.05)
+    assert stats["duration_seconds"] == pytest.approx(10.1, abs=0.05)
+    assert stats["phonation_ratio"] == pytest.approx(8.0 / 10.1, abs=0.01)
+
+
+def test_detect_pauses_needs_a_frame():
+    assert detect_pauses(silence(0.001)) is None
+
+
+def test_preprocess_splits_long_wav_with_offsets(tmp_path):
+    lead = 1.0
+    samples = np.concatenate([silence(lead), talk(200)])
+    path = tmp_path / "answer.wav"
+    path.write_bytes(encode_wav(samples))
+
+    parts, report = preprocess_audio(str(path))
+    try:
+        assert report["applied"] and report["decoder"] == "wav"
+        assert report["segments"] == len(parts) > 2
+        assert "waveform" in report
+        pad = audio.AUDIO_TRIM_PAD_MS / 1000
+        assert parts[0][1] == pytest.approx(lead - pad)
+
+        # Each part starts where the previous one ended, on the original timeline
+        offset = parts[0][1]
+        for part_path, part_offset in parts:
+            assert part_offset == pytest.approx(offset)
+            decoded, _ = decode_audio(part_path)
+            offset += len(decoded) / SAMPLE_RATE
+        for _, part_offset in parts[1:]:
+            assert in_pause(seconds(part_offset), lead)
+    finally:
+        for part_path, _ in parts:
+            if part_path != str(path):
+                audio.os.remove(part_path)
+
+
+def test_undecodable_file_is_sent_unchanged(tmp_path):
+    path = tmp_path / "answer.webm"
+    path.write_bytes(b"\x1a\x45\xdf\xa3" + bytes(1000))
+    parts, report = preprocess_audio(str(path))
+    assert parts == [(str(path), 0.0)]
+    assert not report["applied"] and "ffmpeg" in report["reason"]
+
+
+def test_unsplit_file_over_whisper_limit_fails_clearly(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio, "WHISPER_MAX_BYTES", 500)
+    path = tmp_path / "answer.webm"
+    path.write_bytes(bytes(1000))
+    report = {"reason": "no decoder for this format (install ffmpeg)"}
+    with pytest.raises(AudioTooLargeError, match="ffmpeg"):
+        check_whisper_size([(str(path), 0.0)], report)
+    monkeypatch.setattr(audio, "WHISPER_MAX_BYTES", 1000)
+    check_whisper_size([(str(path), 0.0)], report)
@@ -0,0 +1,84 @@
+import pytest
+
+from app.fluency import fluency_features, fluency_prompt_block, word_features
+
+
+def timed(spec):
+    """
+    Words from (text, gap before it in seconds) pairs, each word 0.3 s long.
+    """
+    words, t = [], 0.0
+    for text, gap in spec:
+        t += gap
+        words.append({"word": text, "start": round(t, 2), "end": round(t + 0.3, 2)})
+        t += 0.3
+    return words
+
+
+WAVEFORM = {
+    "duration_seconds": 12.0,
+    "phonation_ratio": 0.8,
+    "pause_count": 3,
+    "long_pause_count": 1,
+    "pause_seconds": 2.4,
+    "mean_pause_seconds": 0.8,
+    "pauses_per_minute": 15.0,
+}
+
+
+def test_rates_and_pauses():
+    # 10 words, pauses of 0.5 s and 1.5 s; other gaps of 0.1 s are not pauses
+    words = timed([
+        ("Well", 0.0), ("I", 0.1), ("think", 0.1), ("um,", 0.5), ("my", 0.1),
+        ("hometown", 0.1), ("is", 1.5), ("quite", 0.1), ("uh", 0.1), ("small.", 0.1),
+    ])
+    f = word_features(words)
+    span = 10 * 0.3 + 7 * 0.1 + 0.5 + 1.5
+    assert f["word_count"] == 10
+    assert f["speaking_seconds"] == pytest.approx(span, abs=0.01)
+    assert f["speech_rate_wpm"] == pytest.approx(10 * 60 / span, abs=0.1)
+    assert f["articulation_rate_wpm"] == pytest.approx(10 * 60 / (span - 2.0), abs=0.1)
+    assert f["pause_count"] == 2
+    assert f["long_pause_count"] == 1
+    assert f["mean_pause_seconds"] == pytest.approx(1.0)
+    assert f["mean_run_words"] == pytest.approx(10 / 3, abs=0.05)
+    # Punctuation and case are ignored when matching fillers
+    assert f["filled_pauses"] == 2
+    assert f["filled_pause_ratio"] == pytest.approx(0.2)
+
+
+def test_no_pauses():
+    f = word_features(timed([("one", 0.0), ("two", 0.1), ("three", 0.1)]))
+    assert f["pause_count"] == f["long_pause_count"] == 0
+    assert f["mean_pause_seconds"] == 0.0
+    assert f["speech_rate_wpm"] == f["articulation_rate_wpm"]
+    assert f["mean_run_words"] == 3
+
+
+def test_too_few_words():
+    assert word_features([]) is None
+    assert word_features(timed([("hello", 0.0)])) is None
+    # Zero-length span (bad timestamps)
+    assert word_features([{"word": "a", "start": 1.0, "end": 1.0}, {"word": "b", "start": 1.0, "end": 1.0}]) is None
+
+
+def test_fluency_features_combines_parts():
+    words = timed([("one", 0.0), ("two", 0.1)])
+    assert fluency_features([], None) is None
+    assert fluency_features([], WAVEFORM) == {"words": None, "waveform": WAVEFORM}
+    combined = fluency_features(words, WAVEFORM)
+    assert combined["words"]["word_count"] == 2
+    assert combined["waveform"] is WAVEFORM
+    assert fluency_features(words)["waveform"] is None
+
+
+def test_prompt_block():
+    assert fluency_prompt_block(None) == ""
+    words = timed([("um", 0.0), ("yes", 1.2), ("right", 0.1)])
+    block = fluency_prompt_block(fluency_features(words, WAVEFORM))
+    assert block.startswith("TIMING MEASUREMENTS")
+    assert "Speech rate:" in block and "1 of them >= 1 s" in block
+    assert "voiced 80% of the time, 3 silent pauses (1 long, 2.4 s in total)" in block
+
+    audio_only = fluency_prompt_block(fluency_features([], WAVEFORM))
+    assert "Speech rate" not in audio_only and "Audio: 12.0 s" in audio_only
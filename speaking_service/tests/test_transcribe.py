@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import evaluate
+
+
+class FakeTranscriptions:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if kwargs["response_format"] == "json":
+            return SimpleNamespace(text=" Hello there. ")
+        return SimpleNamespace(
+            text=" Hello there. ",
+            segments=[SimpleNamespace(start=0.0, end=1.0, text=" Hello there.")],
+            words=[
+                SimpleNamespace(word="Hello", start=0.0, end=0.4),
+                SimpleNamespace(word="there.", start=0.5, end=1.0),
+            ],
+        )
+
+
+@pytest.fixture
+def transcriptions(monkeypatch, tmp_path):
+    fake = FakeTranscriptions()
+    client = SimpleNamespace(audio=SimpleNamespace(transcriptions=fake))
+    monkeypatch.setattr(evaluate, "get_async_client", lambda: client)
+    path = tmp_path / "answer.wav"
+    path.write_bytes(b"RIFF")
+    fake.path = str(path)
+    return fake
+
+
+def test_whisper_returns_word_timestamps(transcriptions, monkeypatch):
+    monkeypatch.setattr(evaluate, "TRANSCRIBE_MODEL", "whisper-1")
+    text, segments, words = asyncio.run(evaluate.transcribe_audio(transcriptions.path, offset=10.0))
+    assert transcriptions.calls[0]["response_format"] == "verbose_json"
+    assert text == "Hello there."
+    assert segments == [{"start": 10.0, "end": 11.0, "text": "Hello there."}]
+    assert [w["start"] for w in words] == [10.0, 10.5]
+
+
+def test_models_without_timestamps_use_plain_json(transcriptions, monkeypatch):
+    monkeypatch.setattr(evaluate, "TRANSCRIBE_MODEL", "gpt-4o-transcribe")
+    text, segments, words = asyncio.run(evaluate.transcribe_audio(transcriptions.path))
+    call = transcriptions.calls[0]
+    assert call["response_format"] == "json" and "timestamp_granularities" not in call
+    assert (text, segments, words) == ("Hello there.", [], [])
+    assert evaluate.fluency_features(words, None) is None
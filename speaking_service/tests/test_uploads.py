@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+
+from app import uploads
+from app.uploads import RequestSizeLimitMiddleware, save_upload
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_DIR", tmp_path)
+    return tmp_path
+
+
+def test_save_upload_streams_and_hashes(upload_dir):
+    data = b"x" * (3 * uploads.UPLOAD_CHUNK_SIZE + 17)
+    path, sha, size = asyncio.run(save_upload(UploadFile(io.BytesIO(data), filename="answer.WAV")))
+    assert path.parent == upload_dir and path.suffix == ".wav"
+    assert path.read_bytes() == data
+    assert sha == hashlib.sha256(data).hexdigest() and size == len(data)
+
+
+def test_save_upload_over_limit_leaves_no_file(upload_dir):
+    upload = UploadFile(io.BytesIO(b"x" * 5000), filename="answer.webm")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(save_upload(upload, limit=1000))
+    assert exc.value.status_code == 413
+    assert list(upload_dir.iterdir()) == []
+
+
+def test_request_limit_rejects_before_the_form_is_parsed():
+    app = FastAPI()
+    app.add_middleware(RequestSizeLimitMiddleware, limit=1000)
+
+    @app.post("/upload")
+    async def upload(audio: UploadFile = File(...)):
+        return {"size": len(await audio.read())}
+
+    client = TestClient(app)
+    assert client.post("/upload", files={"audio": ("a.wav", b"x" * 100)}).json() == {"size": 100}
+    assert client.post("/upload", files={"audio": ("a.wav", b"x" * 2000)}).status_code == 413
+
+    # Chunked body without Content-Length is cut off while it is received
+    body = (b"x" * 100 for _ in range(20))
+    response = client.post("/upload", content=body, headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413